@@ -1,155 +1,157 @@
-import collections
+import argparse
+import logging
+import os.path
 import sys
-import urllib2
 import simplejson
-import datetime
-
-import powerpod
-
-def get_strava_filled(ride):
-	filled_data = []
-	i = 0
-	for data in ride:
-		if data['time'] != i:
-			for i in range(data['time'] - i):
-				filled_data.append(None)
-			i = data['time']
-		filled_data.append(data)
-		i += 1
-	return filled_data
-
-def get_newton_filled(ride):
-	filled_data = []
-	expect = ride.start_time.as_datetime()
-	for data in ride.data:
-		if hasattr(data, 'newton_time'):
-			extra_seconds = int((data.newton_time.as_datetime() - expect).total_seconds())
-			for i in range(extra_seconds):
-				filled_data.append(None)
-			expect = data.newton_time.as_datetime()
-			continue
-		filled_data.append(data)
-		expect += datetime.timedelta(seconds=1)
-	return filled_data
-
-def covariance(xs, ys):
-	zipped = zip(xs, ys)
-	xsum = ysum = x2sum = y2sum = xysum = 0
-	count = 0.0
-	for x, y in zipped:
-		if x is None or y is None:
-			continue
-		count += 1
-		xsum += x
-		ysum += y
-		x2sum += x * x
-		y2sum += y * y
-		xysum += x * y
-	xmean = xsum / count
-	ymean = ysum / count
-	xdev = (x2sum / count - xsum * xsum / count / count) ** 0.5
-	ydev = (y2sum / count - ysum * ysum / count / count) ** 0.5
-	if xdev == 0 or ydev == 0:
-		return 0.0
-	return ((xysum - xmean * ysum - ymean * xsum) / count + xmean * ymean) / xdev / ydev
-
-def correlate(newton_chunk, strava_chunk):
-	streams = []
-	if 'heartrate' in strava_chunk[0]:
-		streams.append((
-				[x.heart_rate if x else None for x in newton_chunk],
-				[x['heartrate'] if x else None for x in strava_chunk]
-			))
-	if 'cadence' in strava_chunk[0]:
-		streams.append((
-				[x.cadence if x else None for x in newton_chunk],
-				[x['cadence'] if x else None for x in strava_chunk]
-			))
-	if 'velocity_smooth' in strava_chunk[0]:
-		streams.append((
-				[x.speed_mph if x else None for x in newton_chunk],
-				[x['velocity_smooth'] if x else None for x in strava_chunk]
-			))
-	best_cov = [float('-inf')]
-	best = 0
-	window = min(len(newton_chunk) - 2, len(strava_chunk) - 2, 60)
-	for offset in range(-window, window + 1):
-		newton_offset = max(offset, 0)
-		strava_offset = max(-offset, 0)
-		cov = [covariance(stream[0][newton_offset:], stream[1][strava_offset:]) for stream in streams]
-		if sum(cov) > sum(best_cov):
-			best_cov = cov
-			best = offset
+
+import numpy
+
+from powerpod import strava
+from powerpod.columns import RideColumns
+from powerpod.resample import Timeline
+from powerpod.rolling import RollingStream, rolling_streams
+from powerpod.alignment import best_lag, coarse_to_fine_lag, piecewise_alignment
+
+LOGGER = logging.getLogger('correlate')
+
+def newton_positions(columns):
+	"""
+	The Newton second of each record, counting seconds of data and of pauses from the ride's start; unlike columns.time, this never goes backwards if the clock was set back at a pause.
+	"""
+	if not len(columns):
+		return numpy.zeros(0, dtype=numpy.int64)
+	steps = numpy.maximum(numpy.diff(columns.time), 1)
+	return numpy.concatenate(([max(columns.time[0], 0)], max(columns.time[0], 0) + numpy.cumsum(steps)))
+
+# (Newton field, Strava stream) pairs which should match.
+COMMON = [('heart_rate', 'heartrate'), ('cadence', 'cadence'), ('speed_mph', 'velocity_smooth')]
+
+def common_streams(newton_filled, strava_filled):
+	""" (Newton, Strava) pairs of per-second masked arrays from Timeline.resample, for the streams both have. """
+	return [(newton_filled[newton_name], strava_filled[strava_name]) for newton_name, strava_name in COMMON if strava_name in strava_filled]
+
+def correlate(streams, newton_length, strava_length, window=None):
+	"""
+	Find the offset between the rides from common_streams; within window seconds if given, or anywhere they overlap by a few minutes.
+	"""
+	if window is None:
+		best, best_cov = coarse_to_fine_lag(streams)
+	else:
+		window = min(newton_length - 2, strava_length - 2, window)
+		best, best_cov = best_lag(streams, range(-window, window + 1))
 	newton_offset = max(best, 0)
 	strava_offset = max(-best, 0)
-	return newton_offset, strava_offset, min(len(newton_chunk) - newton_offset, len(strava_chunk) - strava_offset), best_cov
-
-newton_ride = powerpod.NewtonRide.from_binary(open(sys.argv[1], 'r').read())
-url = 'https://www.strava.com/api/v3/activities/%s/streams/time,distance,cadence,heartrate,velocity_smooth?access_token=%s' % (sys.argv[2], open('/home/bucko/.strava-token', 'r').read()[:-1])
-strava_ride = simplejson.load(urllib2.urlopen(url))
-strava_names = [x['type'] for x in strava_ride]
-strava_points = [dict(zip(strava_names, x)) for x in zip(*(x['data'] for x in strava_ride))]
-
-strava_filled = get_strava_filled(strava_points)
-newton_filled = get_newton_filled(newton_ride)
-
-print >>sys.stderr, "correlating..."
-newton_start, strava_start, length, error = correlate(newton_filled, strava_filled)
-print >>sys.stderr, "correlate", newton_start, strava_start, length, error
-
-records = {
-		'newton_heartrate': lambda record, _ride: record.heart_rate,
-		'newton_cadence': lambda record, _ride: record.cadence,
-		'newton_ground_velocity': lambda record, _ride: round(record.speed_mph * 1.602, 2),
-		'newton_air_velocity': lambda record, ride: round(record.wind_speed_kph(offset=ride.wind_tube_pressure_offset - 10, reference_pressure_Pa=ride.reference_pressure_Pa, reference_temperature_kelvin=ride.reference_temperature_kelvin, wind_scaling_sqrt=ride.wind_scaling_sqrt), 2),
-		'newton_slope': lambda record, _ride: round(record.tilt, 1),
-		'newton_temp': lambda record, _ride: round(record.temperature_kelvin - 273.15, 2),
-		'newton_elevation': lambda record, _ride: round(record.elevation_metres, 2),
-		'newton_power': lambda record, _ride: record.power_watts,
-		'newton_thingy': lambda record, _ride: record.unknown_0,
-		'newton_acceleration': lambda record, _ride: record.acceleration_maybe / 10.0,
-		'elev_corr': lambda record, _ride: record.elevation_metres + record.unknown_0 / .3048,
+	return newton_offset, strava_offset, min(newton_length - newton_offset, strava_length - strava_offset), best_cov
+
+# Output streams, as expressions over a RideColumns giving a value per record.
+COLUMNS = {
+		'newton_heartrate': lambda ride: ride.heart_rate,
+		'newton_cadence': lambda ride: ride.cadence,
+		'newton_ground_velocity': lambda ride: numpy.round(ride.speed_mph * 1.602, 2),
+		'newton_air_velocity': lambda ride: numpy.round(ride.air_speed_kph(), 2),
+		'newton_slope': lambda ride: numpy.round(ride.tilt, 1),
+		'newton_temp': lambda ride: numpy.round(ride.temperature_kelvin - 273.15, 2),
+		'newton_elevation': lambda ride: numpy.round(ride.elevation_metres, 2),
+		'newton_power': lambda ride: ride.power_watts,
+		'newton_thingy': lambda ride: ride.unknown_0,
+		'newton_acceleration': lambda ride: ride.acceleration_maybe / 10.0,
+		'elev_corr': lambda ride: ride.elevation_metres + ride.unknown_0 / .3048,
+}
+
+# Derived over a window of the ride; see powerpod/rolling.py.
+ROLLING = {
+		# Height gained over the last 3km, going by the slope.
+		'slope_average': RollingStream(lambda ride: (ride.tilt + 0.1) * 0.01, 3000, by='distance', aggregate='integral', minimum_weight=2900),
+		'newton_power_30s': RollingStream(lambda ride: ride.power_watts, 30, minimum_weight=30),
+		'newton_air_velocity_smooth': RollingStream(lambda ride: ride.air_speed_kph(), 10),
 }
 
-def integrate_slope(record, _ride):
-	if not hasattr(integrate_slope, 'buf'):
-		integrate_slope.buf = collections.deque()
-		integrate_slope.buf_len = 0.0
-		integrate_slope.buf_int = 0.0
-	integrate_slope.buf.append(record)
-	integrate_slope.buf_len += record.speed_mph * 1602 / 3600.0
-	integrate_slope.buf_int += record.speed_mph * 1602 * (record.tilt + 0.1) * 0.01 / 3600.0
-	while integrate_slope.buf_len > 3000 and False:
-		old = integrate_slope.buf.popleft()
-		integrate_slope.buf_len -= old.speed_mph * 1602 / 3600.0
-		integrate_slope.buf_int -= old.speed_mph * 1602 * old.tilt / 3600.0
-	if integrate_slope.buf_len > 2900:
-		return integrate_slope.buf_int #/ integrate_slope.buf_len
+def to_list(values, present):
+	""" An array -> a list with None where not present, for JSON. """
+	values = values.astype(object)
+	values[~present] = None
+	return values.tolist()
+
+def extradata(columns, strava_ride):
+	"""
+	Line up the Newton ride (a RideColumns) with a Strava activity's streams (as the API gives them), and return the extradata streams in the same form, with the Strava time stream; each has a value (or None) per Strava point.
+
+	The output streams are worked out a column at a time over the Newton records, and taken at the Newton record matching each Strava point all at once, so nothing is done per second in Python.
+	"""
+	strava_timeline = Timeline.from_strava(strava_ride)
+	strava_filled = strava_timeline.resample(strava_timeline.grid(), names=[strava_name for _newton_name, strava_name in COMMON if strava_name in strava_timeline.streams])
+	positions = newton_positions(columns)
+	newton_timeline = Timeline.from_columns(columns, [newton_name for newton_name, _strava_name in COMMON], time=positions)
+	# Newton records are a second apart, so this just spreads them out over the pauses.
+	newton_filled = newton_timeline.resample(newton_timeline.grid(), method='nearest', max_gap=1)
+	newton_length = len(newton_timeline.grid())
+	strava_length = len(strava_timeline.grid())
+	streams = common_streams(newton_filled, strava_filled)
+
+	LOGGER.info("correlating...")
+	newton_start, strava_start, length, error = correlate(streams, newton_length, strava_length)
+	LOGGER.info("correlate %s %s %s %s", newton_start, strava_start, length, error)
+
+	time = [stream for stream in strava_ride if stream['type'] == 'time'][0]
+	# Allow for the Newton's clock drifting (or being reset at a pause) against GPS.
+	LOGGER.info("aligning...")
+	newton_seconds, present = piecewise_alignment(streams, newton_start - strava_start, time['data'])
+	# The record shown at each Strava point, or -1.
+	record_at_second = numpy.empty(newton_length, dtype=numpy.int64)
+	record_at_second.fill(-1)
+	record_at_second[positions] = numpy.arange(len(positions))
+	records = numpy.where(present, record_at_second[newton_seconds] if newton_length else -1, -1)
+	present = records >= 0
+	records = numpy.maximum(records, 0)
+
+	values = {name: expression(columns) for name, expression in COLUMNS.items()}
+	for name, rolled in rolling_streams(ROLLING, columns).items():
+		rolled = numpy.array(rolled, dtype=numpy.float64)
+		values[name] = numpy.round(rolled, 2)
+	data = {'time': time}
+	for name, column in values.items():
+		# Nothing to take from an empty ride.
+		taken = column[records] if len(column) else numpy.zeros(len(records))
+		data[name] = {'type': name, 'resolution': 'high', 'original_size': len(time['data']), 'series_type': 'distance', 'data': to_list(taken, present & ~numpy.isnan(taken.astype(numpy.float64)))}
+	return data
+
+def write_json(fd, streams):
+	""" Write streams as a JSON list a stream at a time, rather than building the whole document as one string. """
+	fd.write('[')
+	for i, stream in enumerate(streams):
+		if i:
+			fd.write(',')
+		simplejson.dump(stream, fd, separators=(',', ':'))
+	fd.write(']\n')
+
+def main():
+	parser = argparse.ArgumentParser(description='Write extradata.json (to stdout) for a Newton ride lined up with a Strava activity')
+	parser.add_argument('ride', help='.raw file')
+	parser.add_argument('activity', help='Strava activity id, or a file of saved streams')
+	parser.add_argument('pyramid', nargs='?', help='also write a level-of-detail pyramid to this directory')
+	parser.add_argument('--binary', help='also write the compact binary format to this file (eg. extradata.bin)')
+	parser.add_argument('--gzip', action='store_true', help='gzip the binary file')
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+	columns = RideColumns.from_filename(args.ride)
+	if os.path.isfile(args.activity):
+		# Streams saved earlier, eg. <activity id>.json; no need to be online.
+		provider = strava.FileStreamProvider(os.path.dirname(args.activity) or '.')
+		activity_id = os.path.splitext(os.path.basename(args.activity))[0]
 	else:
-		return None
-records['slope_average'] = integrate_slope
-
-data = {name: {'type': name, 'resolution': 'high', 'original_size': len(strava_points), 'series_type': 'distance', 'data': []} for name in records.keys()}
-data['time'] = strava_ride[strava_names.index('time')]
-# Lead in with nulls
-for i in range(strava_start):
-	if strava_filled[i] is None:
-		continue
-	for name, _make in records.items():
-		data[name]['data'].append(None)
-# Fill in the newton records
-for i in range(length):
-	if strava_filled[strava_start + i] is None:
-		continue
-	for name, make in records.items():
-		if newton_filled[i + newton_start] is None:
-			data[name]['data'].append(None)
-		else:
-			data[name]['data'].append(make(newton_filled[i + newton_start], newton_ride))
-# Lead out with nulls
-for i in range(len(strava_filled) - strava_start - length):
-	if strava_filled[strava_start + length + i] is None:
-		continue
-	for name, _make in records.items():
-		data[name]['data'].append(None)
-print simplejson.dumps(data.values(), separators=(',', ':'))
+		provider = strava.CachingStreamProvider()
+		activity_id = args.activity
+	data = extradata(columns, provider.get_streams(activity_id))
+	write_json(sys.stdout, data.values())
+	names = [name for name in data if name != 'time']
+	if args.pyramid:
+		# Also write a level-of-detail pyramid for the extension to load progressively.
+		from powerpod.pyramid import write_pyramid
+		write_pyramid(args.pyramid, data['time']['data'], {name: data[name]['data'] for name in names})
+	if args.binary:
+		from powerpod.extradata import write_extradata
+		write_extradata(args.binary, [(name, stream['data']) for name, stream in sorted(data.items())], compress=args.gzip)
+
+if __name__ == '__main__':
+	main()
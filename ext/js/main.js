@@ -1,7 +1,17 @@
+var EXTRA_URL = "https://localhost/extradata";
 var extraData = null;
+// Pyramid index (see powerpod/pyramid.py), and the arrays we've injected into Strava's stream data, by type.
+var pyramid = null;
+var pyramidStreams = {};
+var pyramidLoaded = {};
 
 var loaded = function () {
 	extraData = JSON.parse(this.responseText);
+	add_fields();
+	try_inject();
+}
+
+function add_fields() {
 	// ensure we have an analysis; copied from Strava code
 	var chart_context = pageView.chartContext()
 	pageView.analysisRequest() == null && pageView.analysisRequest(chart_context.createRequest());
@@ -10,6 +20,7 @@ var loaded = function () {
 	analysis.stackedStreamTypes.splice(5, 0, 'grade_smooth');
 	analysis.stackedStreamTypes.splice(6, 0, 'altitude');
 	add_field('newton_air_velocity', 'velocity_smooth', 'Wind Speed (Newton)');
+	add_field('newton_air_velocity_smooth', 'velocity_smooth', 'Wind Speed (N) 10s');
 	add_field('newton_ground_velocity', 'velocity_smooth', 'Ground Speed (Newton)');
 	add_field('newton_cadence', 'cadence', 'Cadence (Newton)');
 	add_field('newton_heartrate', 'heartrate', 'Heart Rate (Newton)');
@@ -19,10 +30,9 @@ var loaded = function () {
 	add_field('slope_average', 'altitude', 'Slope (N) Average');
 	add_field('elev_corr', 'altitude', 'Corrected (N) Ele');
 	add_field('newton_power', 'watts', 'Power (Newton)');
+	add_field('newton_power_30s', 'watts', 'Power (N) 30s');
 	add_field('newton_thingy', 'altitude', 'Unknown (Newton)');
 	add_field('newton_acceleration', 'grade_smooth', 'Acceleration? (Newton)');
-	// inject extra types
-	try_inject();
 }
 
 function add_field(name, base, english) {
@@ -57,10 +67,213 @@ var try_inject = function () {
 	}
 }
 
-var extra_fetch = new XMLHttpRequest();
-extra_fetch.addEventListener('load', loaded);
-extra_fetch.open("GET", "https://localhost/extradata.json");
-extra_fetch.send();
+function fetch_json(url, callback, error) {
+	var request = new XMLHttpRequest();
+	request.addEventListener('load', function () {
+		if (this.status != 200) {
+			error && error();
+			return;
+		}
+		callback(JSON.parse(this.responseText));
+	});
+	request.addEventListener('error', function () { error && error(); });
+	request.open("GET", url);
+	request.send();
+}
+
+var pyramid_loaded = function (index) {
+	pyramid = index;
+	add_fields();
+	try_inject_pyramid();
+}
+
+var try_inject_pyramid = function () {
+	var stream_data = pageView.analysisRequest().streams.streamData.data;
+	if (stream_data == null) {
+		console.log("Retrying");
+		window.setTimeout(try_inject_pyramid, 10);
+		return;
+	}
+	var stream_types = pageView.chartContext().Ride().streamTypes;
+	for (var i = 0; i < pyramid.types.length; i++) {
+		var type = pyramid.types[i];
+		if (!(type in stream_types)) {
+			console.log("Skipping " + type + " as no formatter")
+		} else if (!(type in stream_data)) {
+			console.log("Injecting " + type);
+			// Strava keeps hold of this array, so from here on we fill it in place as levels arrive.
+			var data = new Array(pyramid.length);
+			for (var j = 0; j < data.length; j++) {
+				data[j] = null;
+			}
+			stream_data[type] = pyramidStreams[type] = data;
+		} else {
+			console.log("Skipping " + type + " as exists")
+		}
+	}
+	// Coarsest first, so there's something to look at straight away.
+	load_level(0);
+}
+
+function load_level(level_number) {
+	if (level_number >= pyramid.levels.length) {
+		return;
+	}
+	var level = pyramid.levels[level_number];
+	var chunks = [];
+	for (var i = 0; i < pyramid.chunks[level]; i++) {
+		chunks.push(i);
+	}
+	load_chunks(level, chunks, function () { load_level(level_number + 1); });
+}
+
+function load_chunks(level, chunks, done) {
+	if (chunks.length == 0) {
+		done && done();
+		return;
+	}
+	var chunk = chunks[0];
+	var key = level + '-' + chunk;
+	if (pyramidLoaded[key]) {
+		load_chunks(level, chunks.slice(1), done);
+		return;
+	}
+	fetch_json(EXTRA_URL + '/' + key + '.json', function (data) {
+		pyramidLoaded[key] = true;
+		paint(level, data);
+		load_chunks(level, chunks.slice(1), done);
+	}, function () {
+		console.log("Failed to load " + key);
+		load_chunks(level, chunks.slice(1), done);
+	});
+}
+
+// Lay each bucket's mean over the Strava points in its time range.
+function paint(level, data) {
+	var time = pageView.analysisRequest().streams.streamData.data.time;
+	for (var type in data.streams) {
+		var target = pyramidStreams[type];
+		if (target == null) {
+			continue;
+		}
+		var mean = data.streams[type].mean;
+		for (var i = 0; i < data.index.length; i++) {
+			var end_time = data.time[i] + level;
+			for (var j = data.index[i]; j < target.length && time[j] < end_time; j++) {
+				target[j] = mean[i];
+			}
+		}
+	}
+}
+
+// Fetch the finest level for a range of Strava time (eg. when the chart is zoomed) ahead of the background refinement.
+window.powerpod_load_range = function (start_time, end_time) {
+	if (pyramid == null) {
+		return;
+	}
+	var level = pyramid.levels[pyramid.levels.length - 1];
+	var chunks = [];
+	for (var i = Math.floor(start_time / pyramid.chunk_seconds[level]); i <= Math.floor(end_time / pyramid.chunk_seconds[level]) && i < pyramid.chunks[level]; i++) {
+		chunks.push(i);
+	}
+	load_chunks(level, chunks);
+}
+
+// Decode the binary format written by powerpod/extradata.py into [{type, values (Float64Array, NaN where missing), present (bitmap)}].
+function decode_extradata(buffer) {
+	var view = new DataView(buffer);
+	var magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+	if (magic != 'PPXD' || view.getUint16(4, true) != 1) {
+		throw "Not extradata version 1: " + magic;
+	}
+	var count = view.getUint16(6, true);
+	var length = view.getUint32(8, true);
+	var offset = 12;
+	var streams = [];
+	for (var s = 0; s < count; s++) {
+		var name = '';
+		for (var i = 0; i < view.getUint8(offset); i++) {
+			name += String.fromCharCode(view.getUint8(offset + 1 + i));
+		}
+		offset += 1 + name.length;
+		var places = view.getUint8(offset);
+		var width = view.getUint8(offset + 1);
+		var present_count = view.getUint32(offset + 2, true);
+		var value = view.getInt32(offset + 6, true);
+		offset += 10;
+		var present = new Uint8Array(buffer, offset, (length + 7) >> 3);
+		offset += present.length;
+		offset += (4 - offset % 4) % 4;
+		// Padded so that these views are aligned; the data is little-endian, as are the machines this runs on.
+		var Deltas = width == 1 ? Int8Array : width == 2 ? Int16Array : Int32Array;
+		var deltas = new Deltas(buffer, offset, Math.max(present_count - 1, 0));
+		offset += deltas.byteLength;
+		offset += (4 - offset % 4) % 4;
+		var scale = Math.pow(10, places);
+		var values = new Float64Array(length);
+		var seen = 0;
+		for (var i = 0; i < length; i++) {
+			if (present[i >> 3] & (1 << (i & 7))) {
+				if (seen > 0) {
+					value += deltas[seen - 1];
+				}
+				seen++;
+				values[i] = value / scale;
+			} else {
+				values[i] = NaN;
+			}
+		}
+		streams.push({type: name, values: values, present: present});
+	}
+	return streams;
+}
+
+var binary_loaded = function (buffer) {
+	var streams = decode_extradata(buffer);
+	// Strava wants plain arrays with nulls for the holes.
+	extraData = [];
+	for (var i = 0; i < streams.length; i++) {
+		var data = new Array(streams[i].values.length);
+		for (var j = 0; j < data.length; j++) {
+			data[j] = isNaN(streams[i].values[j]) ? null : streams[i].values[j];
+		}
+		extraData.push({type: streams[i].type, data: data});
+	}
+	add_fields();
+	try_inject();
+}
+
+function fetch_binary(url, callback, error) {
+	var request = new XMLHttpRequest();
+	request.responseType = 'arraybuffer';
+	request.addEventListener('load', function () {
+		if (this.status != 200) {
+			error && error();
+			return;
+		}
+		var buffer = this.response;
+		var bytes = new Uint8Array(buffer, 0, 2);
+		if (bytes[0] == 0x1f && bytes[1] == 0x8b) {
+			// Gzipped, but not served with Content-Encoding: gzip, so the browser didn't undo it for us.
+			new Response(new Blob([buffer]).stream().pipeThrough(new DecompressionStream('gzip'))).arrayBuffer().then(callback);
+		} else {
+			callback(buffer);
+		}
+	});
+	request.addEventListener('error', function () { error && error(); });
+	request.open("GET", url);
+	request.send();
+}
+
+// Prefer the pyramid, then the binary file, then the JSON one.
+fetch_json(EXTRA_URL + '/index.json', pyramid_loaded, function () {
+	fetch_binary(EXTRA_URL + '.bin', binary_loaded, function () {
+		var extra_fetch = new XMLHttpRequest();
+		extra_fetch.addEventListener('load', loaded);
+		extra_fetch.open("GET", EXTRA_URL + ".json");
+		extra_fetch.send();
+	});
+});
 
 // Patch d3 to force Strava lines to leave holes where data is missing.
 var old_line = d3.svg.line;
@@ -1,4 +1,32 @@
-from .connection import *
-from .messages import *
-from . import types
-from .misc import *
+"""
+The names in connection, messages and misc can be used from the package (powerpod.GetFileCommand and so on), as if they'd been star-imported here, and so can the submodules (powerpod.types); but nothing is imported until it's first used, so importing powerpod costs next to nothing.
+"""
+import imp
+import importlib
+import sys
+
+# Searched in this order, so that a name in more than one of them comes from the same module it would with `from .connection import *` and so on in the opposite order.
+STAR_MODULES = ('misc', 'messages', 'connection')
+
+class LazyPackage(type(sys)):
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError(name)
+		try:
+			imp.find_module(name, self.__path__)
+		except ImportError:
+			pass
+		else:
+			return importlib.import_module('.' + name, self.__name__)
+		for module_name in STAR_MODULES:
+			module = importlib.import_module('.' + module_name, self.__name__)
+			if hasattr(module, name):
+				value = getattr(module, name)
+				setattr(self, name, value)
+				return value
+		raise AttributeError("'module' object has no attribute '{}'".format(name))
+
+# Python 2 modules can't have __getattr__, so the package is replaced by one which can. The original stays referenced (as _module), since Python 2 clears a module's globals when it's freed.
+_module = sys.modules[__name__]
+sys.modules[__name__] = LazyPackage(__name__)
+sys.modules[__name__].__dict__.update(_module.__dict__)
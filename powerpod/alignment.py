@@ -0,0 +1,248 @@
+"""
+Finding the offset between a Newton ride and a GPS track by correlating the streams they have in common.
+
+Streams are lists with None for missing seconds. For each lag, the Pearson correlation is taken over just the seconds where both streams have data; every lag at once, via FFT, as each of the sums it needs is itself a cross-correlation of the values or their mask.
+
+Lags are as in correlate.py: at lag L >= 0, newton[L + k] is compared with strava[k]; at L < 0, newton[k] with strava[k - L].
+"""
+import numpy
+
+def to_masked(values):
+	""" A list with None gaps (or a numpy masked array) -> (values with 0 for None, 1/0 mask), as float arrays. """
+	if isinstance(values, numpy.ma.MaskedArray):
+		return values.filled(0).astype(numpy.float64), (~numpy.ma.getmaskarray(values)).astype(numpy.float64)
+	mask = numpy.array([value is not None for value in values], dtype=numpy.float64)
+	values = numpy.array([0 if value is None else value for value in values], dtype=numpy.float64)
+	return values, mask
+
+def cross_correlate(a, b):
+	"""
+	r[lag] = sum over k of a[k + lag] * b[k], for every lag from -(len(b) - 1) to len(a) - 1, indexed by lag + len(b) - 1.
+	"""
+	size = 1 << int(numpy.ceil(numpy.log2(len(a) + len(b) - 1)))
+	full = numpy.fft.irfft(numpy.fft.rfft(a, size) * numpy.conj(numpy.fft.rfft(b, size)), size)
+	return numpy.concatenate((full[size - len(b) + 1:], full[:len(a)]))
+
+def masked_correlation(x, mask_x, y, mask_y, min_overlap=1):
+	"""
+	Returns (lags, coefficients): the correlation of x and y over the seconds where both have data, for every lag at which they overlap. Lags with fewer than min_overlap seconds in common, or where either side is constant, get 0.
+	"""
+	count = numpy.round(cross_correlate(mask_x, mask_y))
+	sum_x = cross_correlate(x, mask_y)
+	sum_y = cross_correlate(mask_x, y)
+	sum_xx = cross_correlate(x * x, mask_y)
+	sum_yy = cross_correlate(mask_x, y * y)
+	sum_xy = cross_correlate(x, y)
+	lags = numpy.arange(-(len(y) - 1), len(x))
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		mean_x = sum_x / count
+		mean_y = sum_y / count
+		var_x = sum_xx / count - mean_x * mean_x
+		var_y = sum_yy / count - mean_y * mean_y
+		coefficients = (sum_xy / count - mean_x * mean_y) / numpy.sqrt(var_x * var_y)
+		# FFT rounding leaves a constant stream with a tiny variance rather than none.
+		flat = (count < max(min_overlap, 1)) | (var_x <= 1e-9 * sum_xx / count) | (var_y <= 1e-9 * sum_yy / count)
+	coefficients[flat | ~numpy.isfinite(coefficients)] = 0.0
+	return lags, coefficients
+
+def correlation_at(x, mask_x, y, mask_y, lag, min_overlap=1):
+	""" The coefficient of masked_correlation at one lag, computed directly. """
+	x_start = max(lag, 0)
+	y_start = max(-lag, 0)
+	length = min(len(x) - x_start, len(y) - y_start)
+	if length <= 0:
+		return 0.0
+	both = (mask_x[x_start:x_start + length] * mask_y[y_start:y_start + length]) > 0
+	xs = x[x_start:x_start + length][both]
+	ys = y[y_start:y_start + length][both]
+	if xs.size < max(min_overlap, 1):
+		return 0.0
+	dev_x = xs.std()
+	dev_y = ys.std()
+	if dev_x == 0 or dev_y == 0:
+		return 0.0
+	return float(((xs - xs.mean()) * (ys - ys.mean())).mean() / dev_x / dev_y)
+
+def total_correlation(masked, min_overlap=1):
+	""" (lags, sum of coefficients over the streams) for a list of (x, mask_x, y, mask_y). """
+	total = None
+	for x, mask_x, y, mask_y in masked:
+		lags, coefficients = masked_correlation(x, mask_x, y, mask_y, min_overlap)
+		total = coefficients if total is None else total + coefficients
+	return lags, total
+
+def _best_of(masked, lags, min_overlap=1):
+	lags = numpy.asarray(lags)
+	all_lags, total = total_correlation(masked, min_overlap)
+	total = total[lags - all_lags[0]]
+	best = None
+	best_coefficients = None
+	for lag in lags[total >= total.max() - 1e-6 * len(masked)]:
+		coefficients = [correlation_at(x, mask_x, y, mask_y, lag, min_overlap) for x, mask_x, y, mask_y in masked]
+		if best is None or sum(coefficients) > sum(best_coefficients):
+			best = int(lag)
+			best_coefficients = coefficients
+	return best, best_coefficients
+
+def best_lag(streams, lags, min_overlap=1):
+	"""
+	streams is a list of (newton values, strava values) lists with None gaps. Returns the lag in lags (increasing) with the greatest total correlation, and the per-stream coefficients there; the first such lag wins ties.
+
+	The FFT narrows lags down to those within rounding of the best, and those are checked directly, so the answer is the same as checking every lag directly.
+	"""
+	return _best_of([to_masked(newton) + to_masked(strava) for newton, strava in streams], lags, min_overlap)
+
+def downsample(values, mask, factor):
+	""" Average values over blocks of factor seconds, ignoring gaps; blocks with no data are gaps. """
+	blocks = -(-len(values) // factor)
+	padded = blocks * factor - len(values)
+	count = numpy.concatenate((mask, numpy.zeros(padded))).reshape(blocks, factor).sum(axis=1)
+	total = numpy.concatenate((values, numpy.zeros(padded))).reshape(blocks, factor).sum(axis=1)
+	present = count > 0
+	return numpy.where(present, total / numpy.maximum(count, 1), 0), present.astype(numpy.float64)
+
+def _peaks(lags, total, candidates):
+	""" The lags of the candidates highest local maxima of total. """
+	higher_than_left = numpy.concatenate(([True], total[1:] >= total[:-1]))
+	higher_than_right = numpy.concatenate((total[:-1] >= total[1:], [True]))
+	peaks = numpy.flatnonzero(higher_than_left & higher_than_right)
+	peaks = peaks[numpy.argsort(-total[peaks], kind='mergesort')][:candidates]
+	return lags[peaks]
+
+COARSE_FACTORS = (60, 10)
+CANDIDATES = 5
+MIN_OVERLAP = 300
+
+def coarse_to_fine_lag(streams, factors=COARSE_FACTORS, candidates=CANDIDATES, min_overlap=MIN_OVERLAP):
+	"""
+	Like best_lag, but over every lag at which the rides overlap by at least min_overlap seconds.
+
+	The streams are averaged over factors[0] second blocks and correlated at every lag; the best few peaks are refined with each finer factor in turn, searching only a block either side of them, and finally at full resolution.
+	"""
+	masked = [to_masked(newton) + to_masked(strava) for newton, strava in streams]
+	newton_length = len(masked[0][0])
+	strava_length = len(masked[0][2])
+	min_overlap = min(min_overlap, newton_length, strava_length)
+	found = None
+	for factor in factors:
+		coarse = [downsample(x, mask_x, factor) + downsample(y, mask_y, factor) for x, mask_x, y, mask_y in masked]
+		lags, total = total_correlation(coarse, max(min_overlap // factor, 1))
+		if found is not None:
+			# Blocks don't line up exactly between levels, so look two of the last level's blocks either side.
+			near = numpy.zeros(len(lags), dtype=bool)
+			for lag in found:
+				near |= numpy.abs(lags * factor - lag) <= 2 * previous
+			lags = lags[near]
+			total = total[near]
+		found = _peaks(lags, total, candidates) * factor
+		previous = factor
+	if found is None:
+		lags = numpy.arange(-(strava_length - min_overlap), newton_length - min_overlap + 1)
+	else:
+		lags = numpy.unique(numpy.concatenate([numpy.arange(lag - 2 * previous, lag + 2 * previous + 1) for lag in found]))
+		lags = lags[(lags >= -(strava_length - min_overlap)) & (lags <= newton_length - min_overlap)]
+	return _best_of(masked, lags, min_overlap)
+
+DRIFT_WINDOW = 600
+DRIFT_STEP = 300
+DRIFT_SEARCH = 60
+MIN_SCORE = 0.5
+
+def newton_segments(present):
+	""" (start, end) of each run of seconds where present is true. """
+	edges = numpy.diff(numpy.concatenate(([0], numpy.asarray(present, dtype=numpy.int8), [0])))
+	return zip(numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1))
+
+def drift_knots(streams, lag, window=DRIFT_WINDOW, step=DRIFT_STEP, search=DRIFT_SEARCH, min_score=MIN_SCORE):
+	"""
+	Correlate window seconds of each Newton segment at a time, every step seconds, within search seconds of lag. Returns [(newton second at the middle of the window, lag there)] for the windows which correlate with a mean coefficient of at least min_score, as a list per segment.
+	"""
+	masked = [to_masked(newton) + to_masked(strava) for newton, strava in streams]
+	present = sum(mask_x for _x, mask_x, _y, _mask_y in masked) > 0
+	strava_length = len(masked[0][2])
+	knots = []
+	for start, end in newton_segments(present):
+		segment_knots = []
+		middles = range(start + window // 2, end - window // 2 + 1, step) or [(start + end) // 2]
+		for middle in middles:
+			newton_start = max(middle - window // 2, start)
+			newton_end = min(middle + window // 2, end)
+			# Just the stretch of Strava this window could match, so the FFTs stay small.
+			strava_start = max(newton_start - lag - search, 0)
+			strava_end = min(newton_end - lag + search, strava_length)
+			if strava_end - strava_start < min(window, newton_end - newton_start) // 2:
+				continue
+			chunk = [(x[newton_start:newton_end], mask_x[newton_start:newton_end], y[strava_start:strava_end], mask_y[strava_start:strava_end]) for x, mask_x, y, mask_y in masked]
+			# In chunk terms, lag L becomes L - newton_start + strava_start.
+			shift = strava_start - newton_start
+			lags = numpy.arange(lag - search, lag + search + 1) + shift
+			lags = lags[(lags > -(strava_end - strava_start)) & (lags < newton_end - newton_start)]
+			if not lags.size:
+				continue
+			found, coefficients = _best_of(chunk, lags, (newton_end - newton_start) // 2)
+			if sum(coefficients) / len(coefficients) >= min_score:
+				segment_knots.append((middle, found - shift))
+		knots.append(((start, end), segment_knots))
+	return knots
+
+def _isotonic(values, weights):
+	""" Least squares non-decreasing fit to values (pool adjacent violators). """
+	blocks = []
+	for value, weight in zip(values, weights):
+		blocks.append([value * weight, weight, 1])
+		while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] > blocks[-1][0] / blocks[-1][1]:
+			total, weight, count = blocks.pop()
+			blocks[-1][0] += total
+			blocks[-1][1] += weight
+			blocks[-1][2] += count
+	fitted = []
+	for total, weight, count in blocks:
+		fitted.extend([total / weight] * count)
+	return fitted
+
+def fit_warp(knots, lag, length):
+	"""
+	Turn drift_knots into the Strava second for each of length Newton seconds (NaN where Newton has no data).
+
+	Within a segment, the lag is interpolated linearly between knots and held at the ends; a segment without knots takes lag. Segments may jump, as the device's clock may be set at a pause, but the Strava times of the knots are forced to be non-decreasing throughout, so the warp never goes backwards.
+	"""
+	newton_seconds = [middle for _segment, segment_knots in knots for middle, _lag in segment_knots]
+	strava_seconds = _isotonic([middle - found for _segment, segment_knots in knots for middle, found in segment_knots], [1.0] * len(newton_seconds))
+	fitted = dict(zip(newton_seconds, strava_seconds))
+	warp = numpy.empty(length)
+	warp.fill(numpy.nan)
+	for (start, end), segment_knots in knots:
+		seconds = numpy.arange(start, end)
+		if not segment_knots:
+			warp[start:end] = seconds - lag
+			continue
+		middles = [middle for middle, _lag in segment_knots]
+		lags = [middle - fitted[middle] for middle in middles]
+		warp[start:end] = seconds - numpy.interp(seconds, middles, lags)
+	return warp
+
+def resample(warp, strava_times, tolerance=0.5):
+	"""
+	For each of strava_times (seconds), the Newton second which warp puts nearest to it. Returns (seconds, present): an int64 array, and a boolean array which is False where there isn't one within tolerance (and seconds is 0).
+	"""
+	strava_times = numpy.asarray(strava_times, dtype=numpy.float64)
+	seconds = numpy.flatnonzero(~numpy.isnan(warp))
+	if not seconds.size:
+		return numpy.zeros(len(strava_times), dtype=numpy.int64), numpy.zeros(len(strava_times), dtype=bool)
+	# Ties (from a flat stretch of warp) go to the earlier second.
+	order = numpy.argsort(warp[seconds], kind='mergesort')
+	seconds = seconds[order]
+	warped = warp[seconds]
+	after = numpy.clip(numpy.searchsorted(warped, strava_times), 0, len(warped) - 1)
+	before = numpy.clip(after - 1, 0, len(warped) - 1)
+	nearest = numpy.where(numpy.abs(warped[before] - strava_times) <= numpy.abs(warped[after] - strava_times), before, after)
+	close = numpy.abs(warped[nearest] - strava_times) <= tolerance
+	return numpy.where(close, seconds[nearest], 0).astype(numpy.int64), close
+
+def piecewise_alignment(streams, lag, strava_times, **kwargs):
+	"""
+	Returns the Newton second to show at each of strava_times (as resample), allowing for clock drift and jumps at pauses around the global lag (from best_lag or coarse_to_fine_lag). kwargs go to drift_knots.
+	"""
+	knots = drift_knots(streams, lag, **kwargs)
+	warp = fit_warp(knots, lag, len(streams[0][0]))
+	return resample(warp, strava_times)
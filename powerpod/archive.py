@@ -0,0 +1,69 @@
+"""
+An archive of downloaded rides, for the simulator to serve as if they were on the device.
+
+Listing the rides reads only each file's header, and a ride's bytes are sent as they are in the file, through mmap, without being decoded into a NewtonRide. The distance in a ride list header is the sum of the ride's speeds, which the file's header doesn't have; it comes from the archive's index (see powerpod.index) if there is one. Otherwise it's worked out from the ride's records the first time the ride is listed, and kept with the ride's summary metrics (see powerpod.summary), so later runs don't decode it again.
+"""
+import logging
+import mmap
+import os
+import os.path
+
+from .bulk import find_rides
+from .types import RECORD_SIZE, NewtonRide, NewtonRideHeader
+
+LOGGER = logging.getLogger(__name__)
+
+def index_distances(directory):
+	""" {filename relative to directory: distance_metres} from the archive's index, or {} if it hasn't got one. """
+	from .index import DEFAULT_FILENAME, RideIndex
+	filename = os.path.join(directory, DEFAULT_FILENAME)
+	if not os.path.exists(filename):
+		return {}
+	with RideIndex(filename) as ride_index:
+		return {row['filename']: row['distance_metres'] for row in ride_index.query(columns=['filename', 'distance_metres'], order_by=None)}
+
+class ArchiveRide(object):
+	""" Looks enough like a NewtonRide for the simulator: get_header and to_binary. """
+	def __init__(self, filename, header, distance_metres=None):
+		self.filename = filename
+		self.header = header
+		self.distance_metres = distance_metres
+
+	def __repr__(self):
+		return '{}({!r})'.format(self.__class__.__name__, self.filename)
+
+	@classmethod
+	def from_filename(cls, filename, distance_metres=None):
+		with open(filename, 'rb') as fd:
+			return cls(filename, NewtonRide.header_from_binary(fd.read(NewtonRide.byte_size())), distance_metres)
+
+	@property
+	def byte_size(self):
+		return NewtonRide.byte_size() + self.header.size * RECORD_SIZE
+
+	def get_header(self):
+		if self.distance_metres is None:
+			from .summary import ride_summary
+			self.distance_metres = ride_summary(self.filename)['distance_metres']
+		return NewtonRideHeader(self.header.unknown_0, self.header.start_time, self.distance_metres)
+
+	def to_binary(self):
+		""" The ride's bytes, mapped rather than read: an mmap, which can be sliced and measured like a string. """
+		with open(self.filename, 'rb') as fd:
+			size = os.fstat(fd.fileno()).st_size
+			if size < self.byte_size:
+				LOGGER.warning("%s is %d bytes, but its header says %d", self.filename, size, self.byte_size)
+			return mmap.mmap(fd.fileno(), min(size, self.byte_size), access=mmap.ACCESS_READ)
+
+def archive_rides(directory):
+	""" An ArchiveRide for each ride under directory, oldest first. """
+	distances = index_distances(directory)
+	rides = []
+	for filename in find_rides(directory):
+		if os.path.getsize(filename) < NewtonRide.byte_size():
+			LOGGER.warning("%s is too short to be a ride; skipping", filename)
+			continue
+		rides.append(ArchiveRide.from_filename(filename, distances.get(os.path.relpath(filename, directory))))
+	rides.sort(key=lambda ride: ride.header.start_time.as_datetime())
+	LOGGER.info("serving %d rides from %s", len(rides), directory)
+	return rides
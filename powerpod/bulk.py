@@ -0,0 +1,186 @@
+"""
+Bulk processing of a directory of downloaded rides across a process pool.
+
+Each job turns a .raw file into one output file next to it (or at the same path under an output directory, so rides with the same name in different subdirectories don't clash). Outputs newer than their ride are skipped; so are outputs whose ride has only been touched, as recorded by content hash in a manifest, keyed by the output's path relative to the manifest.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import os.path
+import time
+
+import simplejson
+
+from . import export
+from .download import write_atomically
+from .summary import ride_summary
+from .types import NewtonRide
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = '.powerpod-bulk.json'
+
+def decode_job(raw_filename, output_filename):
+	""" Fully decode the ride, writing a short description of it. Useful for checking a decoder change against an archive. """
+	with open(raw_filename, 'rb') as fd:
+		ride = NewtonRide.from_binary(fd.read())
+	pauses = sum(1 for record in ride.records if hasattr(record, 'newton_time'))
+	write_atomically(output_filename, simplejson.dumps({
+		'records': ride.size,
+		'pauses': pauses,
+		'header': ride.get_header().to_filename(),
+	}))
+	return ride.size
+
+def summary_job(raw_filename, output_filename):
+	""" Write summary metrics for the ride (which also refreshes its metrics cache). """
+	metrics = ride_summary(raw_filename)
+	write_atomically(output_filename, simplejson.dumps(metrics, sort_keys=True))
+	with open(raw_filename, 'rb') as fd:
+		return NewtonRide.header_from_binary(fd.read(NewtonRide.byte_size())).size
+
+def make_export_job(format):
+	def export_job(raw_filename, output_filename):
+		with open(raw_filename, 'rb', 1 << 16) as in_fd:
+			ride = NewtonRide.from_file(in_fd)
+			with open(output_filename + '.part', 'wb', 1 << 16) as out_fd:
+				export.EXPORTERS[format](ride, out_fd, name=os.path.basename(raw_filename))
+		os.rename(output_filename + '.part', output_filename)
+		return ride.size
+	return export_job
+
+# Each job returns the number of records in the ride (ride.size, pause records included), so records/s means the same whatever the job.
+JOBS = {
+	'decode': ('.decode.json', decode_job),
+	'summary': ('.summary.json', summary_job),
+}
+for _format in export.EXPORTERS:
+	if _format in export.NEEDS_POSITIONS:
+		continue
+	JOBS[_format] = ('.' + _format, make_export_job(_format))
+
+def file_hash(filename):
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as fd:
+		for block in iter(lambda: fd.read(1 << 16), ''):
+			digest.update(block)
+	return digest.hexdigest()
+
+def find_rides(directory):
+	rides = []
+	for dirpath, _dirnames, filenames in os.walk(directory):
+		rides.extend(os.path.join(dirpath, filename) for filename in filenames if filename.endswith('.raw'))
+	return sorted(rides)
+
+def output_filename(raw_filename, job, directory, output_directory=None):
+	""" Where job's output for raw_filename (under directory) goes. """
+	suffix, _function = JOBS[job]
+	base = os.path.splitext(raw_filename)[0]
+	if output_directory is not None:
+		base = os.path.join(output_directory, os.path.relpath(base, directory))
+	return base + suffix
+
+def _process_chunk(chunk):
+	"""
+	Runs in a worker. Returns (raw_filename, output_filename, sha1, records, error) for each ride.
+	"""
+	results = []
+	for job, raw_filename, out_filename in chunk:
+		_suffix, function = JOBS[job]
+		try:
+			records = function(raw_filename, out_filename)
+			results.append((raw_filename, out_filename, file_hash(raw_filename), records, None))
+		except Exception as e:
+			results.append((raw_filename, out_filename, None, 0, '{}: {}'.format(e.__class__.__name__, e)))
+	return results
+
+class BulkResult(object):
+	def __init__(self):
+		self.processed = 0
+		self.skipped = 0
+		self.failed = 0
+		self.records = 0
+		self.seconds = 0.0
+
+	@property
+	def rides_per_second(self):
+		return self.processed / self.seconds if self.seconds else 0.0
+
+	@property
+	def records_per_second(self):
+		return self.records / self.seconds if self.seconds else 0.0
+
+	def __repr__(self):
+		return '{}(processed={}, skipped={}, failed={}, records={}, seconds={:.2f}, rides/s={:.1f}, records/s={:.0f})'.format(
+			self.__class__.__name__, self.processed, self.skipped, self.failed, self.records, self.seconds, self.rides_per_second, self.records_per_second,
+		)
+
+class BulkProcessor(object):
+	def __init__(self, job, output_directory=None, processes=None, chunk_size=4, force=False):
+		assert job in JOBS, job
+		self.job = job
+		self.output_directory = output_directory
+		self.processes = processes
+		self.chunk_size = chunk_size
+		self.force = force
+
+	def manifest_filename(self, directory):
+		return os.path.join(self.output_directory or directory, MANIFEST_FILENAME)
+
+	def manifest_key(self, directory, out_filename):
+		return os.path.relpath(out_filename, self.output_directory or directory)
+
+	def is_up_to_date(self, raw_filename, out_filename, manifest, key):
+		if self.force or not os.path.exists(out_filename):
+			return False
+		if os.path.getmtime(out_filename) >= os.path.getmtime(raw_filename):
+			return True
+		# The ride is newer, but may only have been copied or touched.
+		known_hash = manifest.get(key)
+		if known_hash is None or known_hash != file_hash(raw_filename):
+			return False
+		# Save hashing it again next time.
+		os.utime(out_filename, None)
+		return True
+
+	def run(self, directory):
+		result = BulkResult()
+		start = time.time()
+		if self.output_directory is not None and not os.path.isdir(self.output_directory):
+			os.makedirs(self.output_directory)
+		manifest_filename = self.manifest_filename(directory)
+		manifest = {}
+		if os.path.exists(manifest_filename):
+			with open(manifest_filename, 'r') as fd:
+				manifest = simplejson.load(fd)
+		work = []
+		for raw_filename in find_rides(directory):
+			out_filename = output_filename(raw_filename, self.job, directory, self.output_directory)
+			if self.is_up_to_date(raw_filename, out_filename, manifest, self.manifest_key(directory, out_filename)):
+				result.skipped += 1
+				continue
+			out_directory = os.path.dirname(out_filename)
+			if out_directory and not os.path.isdir(out_directory):
+				os.makedirs(out_directory)
+			work.append((self.job, raw_filename, out_filename))
+		chunks = [work[i:i + self.chunk_size] for i in range(0, len(work), self.chunk_size)]
+		LOGGER.info("%s rides to process in %s chunks; %s up to date", len(work), len(chunks), result.skipped)
+		pool = multiprocessing.Pool(self.processes)
+		try:
+			for results in pool.imap_unordered(_process_chunk, chunks):
+				for raw_filename, out_filename, sha1, records, error in results:
+					if error is not None:
+						LOGGER.warning("%s failed: %s", raw_filename, error)
+						result.failed += 1
+						continue
+					manifest[self.manifest_key(directory, out_filename)] = sha1
+					result.processed += 1
+					result.records += records
+		finally:
+			pool.close()
+			pool.join()
+		if work:
+			write_atomically(manifest_filename, simplejson.dumps(manifest, sort_keys=True))
+		result.seconds = time.time() - start
+		return result
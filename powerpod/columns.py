@@ -0,0 +1,122 @@
+"""
+Columnar decoding of ride records with numpy.
+
+NewtonRideData decodes one record at a time into an object, which is fine for looking at a ride but slow for analysing an archive. RideColumns unpacks all of a ride's records at once into one numpy array per field of RIDE_DATA_FIELDS, plus the time of each record, which is what summaries, power curves and resampling want anyway.
+
+Only analysis code imports this, so numpy is not needed to talk to the device.
+"""
+import numpy
+
+from .types import DEVICE_METRES_PER_MILE, PAUSE_TAG, RECORD_SIZE, RIDE_DATA_FIELDS, NewtonRide, NewtonTime, wind_tube_speed_kph
+
+def _to_signed(bits):
+	return lambda x: numpy.where(x & (1 << (bits - 1)), x - (1 << bits), x)
+
+# Vectorised versions of the decode functions in RIDE_DATA_FIELDS which aren't IDENTITY; they act on the raw unsigned bit fields.
+COLUMN_DECODE = {
+	'elevation_feet': lambda x: _to_signed(16)((x >> 8) | ((x & 0xff) << 8)),
+	'temperature_farenheit': lambda x: x - 100,
+	'unknown_0': _to_signed(9),
+	'tilt': lambda x: _to_signed(10)(x) * 0.1,
+	'speed_mph': lambda x: x * 0.1,
+	'acceleration_maybe': _to_signed(10),
+}
+
+def decode_records(data):
+	"""
+	Decode the 15 byte data records in the string data (which must contain no pause records) to {field name: array}.
+	"""
+	assert len(data) % RECORD_SIZE == 0, len(data)
+	rows = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, RECORD_SIZE)
+	bits = numpy.unpackbits(rows, axis=1)
+	columns = {}
+	start = 0
+	for name, size, _decode, _encode in RIDE_DATA_FIELDS:
+		weights = 1 << numpy.arange(size - 1, -1, -1, dtype=numpy.int64)
+		value = bits[:, start:start + size].dot(weights)
+		start += size
+		if name in COLUMN_DECODE:
+			value = COLUMN_DECODE[name](value)
+		columns[name] = value
+	return columns
+
+class RideColumns(object):
+	"""
+	header is the NewtonRide with records=None. time is the number of seconds from the ride's start_time to each data record; pauses are gaps in time. Each field of NewtonRideData is an attribute holding an array with one entry per data record.
+	"""
+	def __init__(self, header, time, columns):
+		self.header = header
+		self.time = time
+		self.columns = columns
+		for name, value in columns.items():
+			setattr(self, name, value)
+
+	def __len__(self):
+		return len(self.time)
+
+	@classmethod
+	def from_binary(cls, data):
+		header_size = NewtonRide.byte_size()
+		header = NewtonRide.header_from_binary(data[:header_size])
+		body = data[header_size:header_size + header.size * RECORD_SIZE]
+		assert len(body) == header.size * RECORD_SIZE, (header.size, len(body))
+		rows = numpy.frombuffer(body, dtype=numpy.uint8).reshape(-1, RECORD_SIZE)
+		paused = (rows[:, :len(PAUSE_TAG)] == 0xff).all(axis=1)
+		# A data record's time is when its segment started (from the pause record before it, or the ride's start) plus the number of data records between.
+		pause_rows = numpy.flatnonzero(paused)
+		start_time = header.start_time.as_datetime()
+		segment_starts = [0]
+		for row in pause_rows:
+			newton_time = NewtonTime.from_binary(body[row * RECORD_SIZE + len(PAUSE_TAG):row * RECORD_SIZE + len(PAUSE_TAG) + 8])
+			segment_starts.append(int((newton_time.as_datetime() - start_time).total_seconds()))
+		data_rows = ~paused
+		segment = numpy.cumsum(paused)[data_rows]
+		index = numpy.arange(segment.size)
+		data_before_pause = numpy.concatenate(([0], numpy.cumsum(data_rows)[pause_rows]))
+		time = index + (numpy.array(segment_starts, dtype=numpy.int64) - data_before_pause)[segment]
+		columns = decode_records(rows[data_rows].tostring())
+		return cls(header, time, columns)
+
+	@classmethod
+	def from_filename(cls, filename):
+		with open(filename, 'rb') as fd:
+			return cls.from_binary(fd.read())
+
+	@property
+	def segment_starts(self):
+		""" Indices of the first record of each run of records a second apart. """
+		if not len(self):
+			return numpy.zeros(0, dtype=numpy.int64)
+		return numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(self.time) != 1) + 1))
+
+	def segments(self):
+		""" Yield a slice for each run of records a second apart. """
+		bounds = list(self.segment_starts) + [len(self)]
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			yield slice(start, end)
+
+	@property
+	def speed_metres_per_second(self):
+		return self.speed_mph * DEVICE_METRES_PER_MILE / 3600.0
+
+	@property
+	def elevation_metres(self):
+		return self.elevation_feet * 0.3048
+
+	# As NewtonRideData's methods, for whole columns.
+	def pressure_Pa(self, reference_pressure_Pa=101325, reference_temperature_kelvin=288.15):
+		return reference_pressure_Pa * (1 - (0.0065 * self.elevation_metres) / reference_temperature_kelvin) ** (9.80665 * 0.0289644 / 8.31447 / 0.0065)
+
+	@property
+	def temperature_kelvin(self):
+		return (self.temperature_farenheit + 459.67) * 5 / 9
+
+	def density(self, reference_pressure_Pa=101325, reference_temperature_kelvin=288.15):
+		return self.pressure_Pa(reference_pressure_Pa, reference_temperature_kelvin) * 0.0289644 / 8.31447 / self.temperature_kelvin
+
+	def wind_speed_kph(self, offset=621, multiplier=13.6355, reference_pressure_Pa=101325, reference_temperature_kelvin=288.15, wind_scaling_sqrt=1.0):
+		return wind_tube_speed_kph(self.wind_tube_pressure_difference, self.density(reference_pressure_Pa, reference_temperature_kelvin), offset, multiplier, wind_scaling_sqrt)
+
+	def air_speed_kph(self):
+		""" wind_speed_kph with the ride's calibration, as NewtonRide.wind_speed_kph. """
+		return self.wind_speed_kph(**self.header.wind_calibration())
@@ -1,17 +1,47 @@
 import logging
 import operator
-from socket import timeout
 from . import messages
 
-import serial
-
 LOGGER = logging.getLogger(__name__)
 
-class NewtonSerialConnection(serial.Serial):
+class NewtonProtocolError(Exception):
+	pass
+
+class ConnectionWrapper(object):
+	"""
+	Passes everything through to the connection it wraps, so that subclasses need only change what they're for.
+	"""
+	def __init__(self, connection):
+		self._connection = connection
+
+	def __getattr__(self, name):
+		return getattr(self._connection, name)
+
+	@property
+	def timeout(self):
+		return self._connection.timeout
+
+	@timeout.setter
+	def timeout(self, value):
+		self._connection.timeout = value
+
+	def __enter__(self):
+		self._connection.__enter__()
+		return self
+
+	def __exit__(self, *args):
+		return self._connection.__exit__(*args)
+
+class NewtonSerialConnection(ConnectionWrapper):
+	"""
+	Wraps a pyserial port. pyserial is only imported once a connection is made, so offline tools needn't pay for it.
+	"""
 	def __init__(self, port='/dev/ttyUSB0', baudrate=115200):
-		super(NewtonSerialConnection, self).__init__(port=port, baudrate=baudrate)
+		import serial
+		ConnectionWrapper.__init__(self, serial.Serial(port=port, baudrate=baudrate))
 
 	def __enter__(self):
+		import serial
 		try:
 			self.open()
 		except serial.serialutil.SerialException:
@@ -98,9 +128,8 @@ class MessagePacket(Packet):
 
 	@classmethod
 	def parse(cls, data):
-		if data[:2] != '\xf7\x7f':
+		if data[:2] != '\xf7\x7f' or len(data) < 3:
 			return None
-		length = ord(data[3])
 		if ord(data[2]) + 4 != len(data):
 			return None
 		checksum = data[-1]
@@ -146,7 +175,11 @@ class NewtonSerialProtocol(object):
 				remain = packet_type.read_length(data)
 				if remain <= 0:
 					break
-				data += self.connection.read(remain)
+				more = self.connection.read(remain)
+				if not more:
+					# Cut short (a byte lost on the line); it won't parse, but don't wait forever for the rest.
+					break
+				data += more
 			packet = packet_type.parse(data)
 			if packet is None:
 				LOGGER.debug("packet is None")
@@ -173,7 +206,9 @@ class NewtonSerialProtocol(object):
 		while True:
 			if conversation:
 				LOGGER.warning("unexpected_read_conversation %r", conversation)
-				self.write_packet(InterruptPacket())
+				# The other side has already given up on an interrupted conversation; answering in kind would have us interrupting each other forever.
+				if not isinstance(conversation[-1], InterruptPacket):
+					self.write_packet(InterruptPacket())
 				conversation = []
 			conversation.append(self.read_packet())
 			if not isinstance(conversation[-1], ReadyPacket):
@@ -201,11 +236,13 @@ class NewtonSerialProtocol(object):
 		# just do nothing (no reply, eg. set time)
 		if message is None:
 			self.write_packet(CommandAckPacket())
-			return
-		message_parts = [ message[63*i:63*(i+1)] for i in range(len(message)/63+1) ]
+			return True
+		# Sliced as they're sent, so a response can be a ride put together as it goes (see powerpod.synthetic.RideStream).
+		message_parts = ( message[63*i:63*(i+1)] for i in range(len(message)/63+1) )
 		for message_part in message_parts:
 			if not self._write_message_part(message_part):
-				return
+				return False
+		return True
 
 	@property
 	def ack_to_send(self):
@@ -223,7 +260,8 @@ class NewtonSerialProtocol(object):
 
 	def _write_message_part(self, message_part):
 		self.write_packet(ReadyPacket())
-		packet = self.read_packet()
+		# A device which isn't ready to talk may never ack; don't wait forever.
+		packet = self.read_packet(allow_empty=True)
 		if not isinstance(packet, AckPacket):
 			LOGGER.warning("unexpected_write_ready %r", packet)
 			self.write_packet(InterruptPacket())
@@ -238,7 +276,8 @@ class NewtonSerialProtocol(object):
 		return True
 
 	def do_command(self, command):
-		self.write_message(command.to_binary())
+		if not self.write_message(command.to_binary()):
+			raise NewtonProtocolError("device did not accept {!r}".format(command))
 		if not hasattr(command.RESPONSE, 'from_binary'):
 			response = self.read_packet(allow_empty=True)
 			if response is None:
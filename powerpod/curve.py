@@ -0,0 +1,112 @@
+"""
+Mean-maximal power curves: the best average power held for each duration, per ride and across an archive.
+
+A ride's curve comes from the cumulative sum of its power: the total over any window is one subtraction, so each duration costs one vectorised pass. Windows which would span a pause are dropped. Curves are cached per ride (see summary.cached), and the archive curve is the best of them, kept in the archive directory and only touched for rides which are new or have changed.
+"""
+import logging
+import os
+import os.path
+
+import numpy
+import simplejson
+
+from .bulk import find_rides
+from .download import write_atomically
+from .summary import cached
+
+LOGGER = logging.getLogger(__name__)
+
+CURVE_VERSION = 1
+CACHE_SUFFIX = '.curve.json'
+ARCHIVE_FILENAME = '.powerpod-curve.json'
+STREAMS = ('power_watts', 'dfpm_power_watts')
+
+def _durations():
+	# Every second at first, then coarser steps; the curve changes slowly at long durations, and this keeps a 5h curve to ~550 passes.
+	durations = []
+	for start, end, step in [(1, 120, 1), (120, 600, 5), (600, 3600, 30), (3600, 5 * 3600, 60)]:
+		durations.extend(range(start, end, step))
+	durations.append(5 * 3600)
+	return durations
+DURATIONS = _durations()
+# The usual points to quote.
+ROUND_DURATIONS = [1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 2 * 3600, 3 * 3600, 5 * 3600]
+
+def mean_maximal(values, time, durations=DURATIONS):
+	"""
+	Return the best mean of values over each duration (in seconds) as a list, with None for durations longer than any unpaused stretch. time is the second of each value, as in RideColumns.
+	"""
+	cumulative = numpy.concatenate(([0], numpy.cumsum(values, dtype=numpy.int64)))
+	best = []
+	for duration in durations:
+		unpaused = time[duration - 1:] - time[:max(len(time) - duration + 1, 0)] == duration - 1
+		if not unpaused.any():
+			# durations is increasing, so nothing longer fits either.
+			break
+		totals = cumulative[duration:] - cumulative[:-duration]
+		best.append(round(totals[unpaused].max() / float(duration), 1))
+	return best + [None] * (len(durations) - len(best))
+
+def ride_curve(columns, durations=DURATIONS):
+	return {stream: mean_maximal(getattr(columns, stream), columns.time, durations) for stream in STREAMS}
+
+def cached_ride_curve(raw_filename, durations=DURATIONS):
+	return cached(raw_filename, CACHE_SUFFIX, CURVE_VERSION, {'durations': list(durations)}, lambda columns: ride_curve(columns, durations))
+
+def merge(archive, ride, filename):
+	"""
+	Fold the ride curve into the archive curve ({stream: [[watts, filename] or None, ...]}) in place.
+	"""
+	for stream, watts in ride.items():
+		best = archive.setdefault(stream, [None] * len(watts))
+		for i, value in enumerate(watts):
+			if value is not None and (best[i] is None or value > best[i][0]):
+				best[i] = [value, filename]
+
+class ArchiveCurve(object):
+	"""
+	The archive-wide curve for a directory of rides, saved in ARCHIVE_FILENAME there.
+	"""
+	def __init__(self, directory, durations=DURATIONS):
+		self.directory = directory
+		self.durations = list(durations)
+		self.filename = os.path.join(directory, ARCHIVE_FILENAME)
+		self.rides = {}
+		self.best = {}
+		if os.path.exists(self.filename):
+			with open(self.filename, 'r') as fd:
+				saved = simplejson.load(fd)
+			if saved.get('version') == CURVE_VERSION and saved.get('durations') == self.durations:
+				self.rides = saved['rides']
+				self.best = saved['best']
+
+	def save(self):
+		write_atomically(self.filename, simplejson.dumps({
+			'version': CURVE_VERSION,
+			'durations': self.durations,
+			'rides': self.rides,
+			'best': self.best,
+		}, sort_keys=True))
+
+	def update(self):
+		"""
+		Bring the curve up to date with the rides in the directory; returns the number of rides whose curves were folded in.
+
+		New rides can only raise the curve, so they're merged in. If a ride has changed or gone, the curve is rebuilt from the (cached) ride curves.
+		"""
+		current = {}
+		for path in find_rides(self.directory):
+			stat = os.stat(path)
+			current[os.path.relpath(path, self.directory)] = [stat.st_size, stat.st_mtime]
+		stale = [filename for filename, stat in self.rides.items() if current.get(filename) != stat]
+		if stale:
+			LOGGER.info("%s rides changed or removed; rebuilding the curve", len(stale))
+			self.rides = {}
+			self.best = {}
+		new = sorted(filename for filename in current if filename not in self.rides)
+		for filename in new:
+			merge(self.best, cached_ride_curve(os.path.join(self.directory, filename), self.durations), filename)
+			self.rides[filename] = current[filename]
+		if new or stale:
+			self.save()
+		return len(new)
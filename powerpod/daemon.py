@@ -0,0 +1,83 @@
+import errno
+import logging
+import os
+import socket
+import SocketServer
+import threading
+
+import simplejson
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.expanduser('~/.powerpod.sock')
+
+class DaemonRequestHandler(SocketServer.StreamRequestHandler):
+	"""
+	Reads newline-separated JSON requests and writes one JSON reply line for each.
+	"""
+	def handle(self):
+		for line in self.rfile:
+			try:
+				request = simplejson.loads(line)
+			except ValueError:
+				LOGGER.warning("bad request %r", line)
+				return
+			LOGGER.debug("request %r", request)
+			with self.server.lock:
+				reply = self.server.handler(request)
+			self.wfile.write(simplejson.dumps(reply) + '\n')
+			self.wfile.flush()
+
+class NewtonDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	"""
+	Listens on a Unix domain socket and passes each request to handler.
+
+	Requests from all clients are serialised, so handler may assume it has sole use of the device.
+	"""
+	daemon_threads = True
+
+	def __init__(self, socket_path, handler):
+		self.socket_path = socket_path
+		self.handler = handler
+		self.lock = threading.Lock()
+		if os.path.exists(socket_path):
+			if is_listening(socket_path):
+				raise ValueError("{!r} already has a daemon listening".format(socket_path))
+			LOGGER.info("removing stale socket %r", socket_path)
+			os.unlink(socket_path)
+		SocketServer.UnixStreamServer.__init__(self, socket_path, DaemonRequestHandler)
+
+	def server_close(self):
+		SocketServer.UnixStreamServer.server_close(self)
+		if os.path.exists(self.socket_path):
+			os.unlink(self.socket_path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.server_close()
+
+def is_listening(socket_path):
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(socket_path)
+	except socket.error as e:
+		if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+			return False
+		raise
+	finally:
+		sock.close()
+	return True
+
+def send_request(socket_path, request):
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.connect(socket_path)
+	try:
+		sock.sendall(simplejson.dumps(request) + '\n')
+		reply = sock.makefile('r').readline()
+	finally:
+		sock.close()
+	if not reply:
+		raise ValueError("daemon at {!r} closed the connection".format(socket_path))
+	return simplejson.loads(reply)
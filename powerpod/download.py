@@ -0,0 +1,177 @@
+import logging
+import os
+import os.path
+import Queue
+import threading
+import time
+
+import simplejson
+
+from .connection import NewtonProtocolError
+from .messages import GetFileCommand
+
+LOGGER = logging.getLogger(__name__)
+
+def write_atomically(filename, data):
+	"""
+	Write data to filename such that a reader only ever sees the old file or the complete new one.
+	"""
+	directory = os.path.dirname(filename) or '.'
+	temp_filename = filename + '.part'
+	with open(temp_filename, 'wb') as fd:
+		fd.write(data)
+		fd.flush()
+		os.fsync(fd.fileno())
+	os.rename(temp_filename, filename)
+	# Make the rename itself durable.
+	dir_fd = os.open(directory, os.O_RDONLY)
+	try:
+		os.fsync(dir_fd)
+	finally:
+		os.close(dir_fd)
+
+class Pacer(object):
+	"""
+	Decides how long to wait before each request.
+
+	The device sometimes refuses to ack a request which follows a large transfer too closely. Rather than sleeping a fixed time before every request, we start with no delay, back off whenever the device refuses a request and decay back towards no delay whenever it accepts one.
+	"""
+	def __init__(self, initial=0.0, step=0.25, maximum=5.0, backoff=2.0, decay=0.75):
+		self.delay = initial
+		self.step = step
+		self.maximum = maximum
+		self.backoff = backoff
+		self.decay = decay
+
+	def wait(self):
+		if self.delay > 0:
+			time.sleep(self.delay)
+
+	def accepted(self):
+		self.delay *= self.decay
+		if self.delay < self.step / 10:
+			self.delay = 0.0
+
+	def refused(self):
+		self.delay = min(self.maximum, max(self.delay * self.backoff, self.step))
+		LOGGER.debug("pacer backing off to %.2fs", self.delay)
+
+class SyncJournal(object):
+	"""
+	Records which rides of a scheduled download have been written, so that an interrupted sync can be resumed.
+
+	The journal only applies to the schedule it was written for; if the device's ride list has changed, it's ignored.
+	"""
+	FILENAME = '.powerpod-sync.json'
+
+	def __init__(self, directory, schedule, done=()):
+		self.filename = os.path.join(directory, self.FILENAME)
+		self.schedule = list(schedule)
+		self.done = set(done)
+
+	@classmethod
+	def load(cls, directory, schedule):
+		schedule = list(schedule)
+		journal = cls(directory, schedule)
+		if not os.path.exists(journal.filename):
+			return journal
+		with open(journal.filename, 'r') as fd:
+			data = simplejson.load(fd)
+		if data['schedule'] != schedule:
+			LOGGER.info("ignoring stale journal %r", journal.filename)
+			return journal
+		journal.done.update(data['done'])
+		LOGGER.info("resuming sync; %s of %s rides already written", len(journal.done), len(schedule))
+		return journal
+
+	def mark_done(self, filename):
+		self.done.add(os.path.basename(filename))
+		write_atomically(self.filename, simplejson.dumps({'schedule': self.schedule, 'done': sorted(self.done)}))
+
+	def is_done(self, filename):
+		return os.path.basename(filename) in self.done
+
+	def finish(self):
+		if os.path.exists(self.filename):
+			os.unlink(self.filename)
+
+class RideWriter(threading.Thread):
+	"""
+	Encodes and writes rides on a background thread, so that serial I/O never waits for the disk.
+	"""
+	def __init__(self, journal=None):
+		super(RideWriter, self).__init__(name='RideWriter')
+		self.daemon = True
+		self.journal = journal
+		self.queue = Queue.Queue()
+		self.error = None
+
+	def put(self, filename, ride):
+		if self.error is not None:
+			raise self.error
+		self.queue.put((filename, ride))
+
+	def run(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				return
+			if self.error is not None:
+				continue
+			filename, ride = item
+			try:
+				write_atomically(filename, ride.to_binary())
+				if self.journal is not None:
+					self.journal.mark_done(filename)
+				LOGGER.debug("wrote %r", filename)
+			except Exception as e:
+				LOGGER.exception("failed to write %r", filename)
+				self.error = e
+
+	def close(self):
+		self.queue.put(None)
+		self.join()
+		if self.error is not None:
+			raise self.error
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class RideDownloader(object):
+	"""
+	Fetches rides from the device, pacing requests with a Pacer and retrying any the device refuses.
+	"""
+	def __init__(self, protocol, pacer=None, retries=5):
+		if pacer is None:
+			pacer = Pacer()
+		self.protocol = protocol
+		self.pacer = pacer
+		self.retries = retries
+
+	def fetch(self, index):
+		for attempt in range(self.retries + 1):
+			self.pacer.wait()
+			try:
+				response = self.protocol.do_command(GetFileCommand(index))
+			except NewtonProtocolError:
+				LOGGER.warning("device refused ride %s (attempt %s)", index, attempt + 1)
+				self.pacer.refused()
+				continue
+			self.pacer.accepted()
+			return response.ride_data
+		raise NewtonProtocolError("gave up fetching ride {}".format(index))
+
+	def download(self, schedule, writer):
+		"""
+		Fetch each (index, filename) in schedule, handing the rides to writer as they arrive.
+		"""
+		start = time.time()
+		for index, filename in schedule:
+			ride = self.fetch(index)
+			LOGGER.info("index=%s header=%s filename=%s", index, ride.get_header(), filename)
+			writer.put(filename, ride)
+		LOGGER.info("fetched %s rides in %.1fs", len(schedule), time.time() - start)
@@ -0,0 +1,197 @@
+"""
+Streaming exporters for rides.
+
+Each exporter walks ride.records exactly once and writes as it goes, so rides opened with NewtonRide.from_file are exported in constant memory; except that TCX wants a lap's totals before its track points, so it holds one lap (the records between two pauses) at a time.
+
+The device has no GPS. GPX track points must have a position, so GPX is only written given positions from elsewhere (eg. a Strava latlng stream aligned to the ride); TCX and CSV need none.
+"""
+import csv
+import os.path
+from xml.sax.saxutils import escape
+
+from .types import DEVICE_METRES_PER_MILE, NewtonRide
+
+GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="powerpod" xmlns="http://www.topografix.com/GPX/1/1" xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" xmlns:powerpod="https://github.com/bucko909/powerpod">
+ <metadata><name>{name}</name><time>{time}</time></metadata>
+ <trk>
+  <name>{name}</name>
+"""
+GPX_POINT = """   <trkpt lat="{latitude:.7f}" lon="{longitude:.7f}"><ele>{elevation:.1f}</ele><time>{time}</time><extensions><powerpod:power>{power}</powerpod:power><gpxtpx:TrackPointExtension><gpxtpx:atemp>{temperature:.1f}</gpxtpx:atemp><gpxtpx:hr>{heart_rate}</gpxtpx:hr><gpxtpx:cad>{cadence}</gpxtpx:cad></gpxtpx:TrackPointExtension><powerpod:air_speed>{air_speed:.2f}</powerpod:air_speed></extensions></trkpt>
+"""
+GPX_FOOTER = """ </trk>
+</gpx>
+"""
+
+TCX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2" xmlns:powerpod="https://github.com/bucko909/powerpod">
+ <Activities>
+  <Activity Sport="Biking">
+   <Id>{time}</Id>
+"""
+# A lap for each run of records between pauses.
+TCX_LAP = """   <Lap StartTime="{time}">
+    <TotalTimeSeconds>{seconds}</TotalTimeSeconds>
+    <DistanceMeters>{distance:.1f}</DistanceMeters>
+    <Calories>{calories}</Calories>
+    <Intensity>Active</Intensity>
+    <TriggerMethod>Manual</TriggerMethod>
+"""
+# ActivityExtension has nowhere for temperature or air speed, so they're in our own namespace, as in GPX.
+TCX_POINT = """      <Trackpoint><Time>{time}</Time><AltitudeMeters>{elevation:.1f}</AltitudeMeters><DistanceMeters>{distance:.1f}</DistanceMeters><HeartRateBpm><Value>{heart_rate}</Value></HeartRateBpm><Cadence>{cadence}</Cadence><Extensions><ns3:TPX><ns3:Speed>{speed:.2f}</ns3:Speed><ns3:Watts>{power}</ns3:Watts></ns3:TPX><powerpod:temperature>{temperature:.1f}</powerpod:temperature><powerpod:air_speed>{air_speed:.2f}</powerpod:air_speed></Extensions></Trackpoint>
+"""
+TCX_FOOTER = """  </Activity>
+ </Activities>
+</TrainingCenterDatabase>
+"""
+
+ISAAC_HEADER_FIELDS = ['Weight (kg)', 'Energy (kJ)', 'Aero', 'Fric', 'Wind Scaling', 'Wheel Circumference (mm)']
+ISAAC_FIELDS = ['Timestamp', 'Speed (km/hr)', 'Wind Speed (km/hr)', 'Power (W)', 'Distance (km)', 'Cadence (RPM)', 'Heartrate (BPM)', 'Elevation (meters)', 'Hill slope (%)', 'Temperature (C)', 'DFPM Power']
+
+def format_time(time):
+	return time.strftime('%Y-%m-%dT%H:%M:%S')
+
+def samples(ride):
+	"""
+	Yield (time, record, distance in metres so far) for each data record of ride, and None between segments which were separated by a pause.
+	"""
+	distance = 0.0
+	last_time = None
+	for time, record in ride.timed_records():
+		if last_time is not None and (time - last_time).total_seconds() != 1:
+			yield None
+		last_time = time
+		distance += record.speed_mph * DEVICE_METRES_PER_MILE / 3600.0
+		yield time, record, distance
+
+def export_gpx(ride, fd, name='powerpod', positions=None):
+	"""
+	positions has (latitude, longitude), or None if it isn't known, for each data record in turn; records without a position are left out.
+	"""
+	if positions is None:
+		raise ValueError("GPX track points need positions, and the ride has none")
+	positions = iter(positions)
+	fd.write(GPX_HEADER.format(name=escape(name), time=format_time(ride.start_time.as_datetime())))
+	fd.write('  <trkseg>\n')
+	for sample in samples(ride):
+		if sample is None:
+			fd.write('  </trkseg>\n  <trkseg>\n')
+			continue
+		time, record, _distance = sample
+		position = next(positions, None)
+		if position is None:
+			continue
+		fd.write(GPX_POINT.format(
+			latitude=position[0],
+			longitude=position[1],
+			elevation=record.elevation_metres,
+			time=format_time(time),
+			power=record.power_watts,
+			temperature=record.temperature_kelvin - 273.15,
+			heart_rate=record.heart_rate,
+			cadence=record.cadence,
+			air_speed=ride.wind_speed_kph(record),
+		))
+	fd.write('  </trkseg>\n')
+	fd.write(GPX_FOOTER)
+
+def _write_tcx_lap(fd, start_time, points, distance, energy_J):
+	fd.write(TCX_LAP.format(
+		time=format_time(start_time),
+		seconds=len(points),
+		distance=distance,
+		# Cycling convention: kJ of work is roughly kcal burned.
+		calories=int(round(energy_J / 1000.0)),
+	))
+	if points:
+		fd.write('    <Track>\n')
+		fd.write(''.join(points))
+		fd.write('    </Track>\n')
+	fd.write('   </Lap>\n')
+
+def export_tcx(ride, fd, name=None):
+	start_time = ride.start_time.as_datetime()
+	fd.write(TCX_HEADER.format(time=format_time(start_time)))
+	# The lap being read: its track points, and where it started.
+	points = []
+	lap_start = start_time
+	lap_distance = 0.0
+	distance = 0.0
+	energy_J = 0
+	for sample in samples(ride):
+		if sample is None:
+			_write_tcx_lap(fd, lap_start, points, distance - lap_distance, energy_J)
+			points = []
+			lap_distance = distance
+			energy_J = 0
+			continue
+		time, record, distance = sample
+		if not points:
+			lap_start = time
+		energy_J += record.power_watts
+		points.append(TCX_POINT.format(
+			time=format_time(time),
+			elevation=record.elevation_metres,
+			distance=distance,
+			heart_rate=record.heart_rate,
+			cadence=record.cadence,
+			speed=record.speed_mph * DEVICE_METRES_PER_MILE / 3600.0,
+			power=record.power_watts,
+			temperature=record.temperature_kelvin - 273.15,
+			air_speed=ride.wind_speed_kph(record),
+		))
+	# A ride without records still gets its (empty) lap, as TCX needs one.
+	_write_tcx_lap(fd, lap_start, points, distance - lap_distance, energy_J)
+	fd.write(TCX_FOOTER)
+
+def export_isaac_csv(ride, fd, name=None):
+	"""
+	Laid out like Isaac's CSV export, so it can be read back with IsaacCSV.
+	"""
+	writer = csv.writer(fd, lineterminator='\n')
+	writer.writerow(['powerpod export'])
+	writer.writerow([ride.start_time.as_datetime().strftime('%Y-%m-%d %H:%M:%S')])
+	writer.writerow(ISAAC_HEADER_FIELDS)
+	writer.writerow([
+		'{:.1f}'.format(ride.total_mass_lb * 0.45359237),
+		'{:.1f}'.format(ride.energy_kJ),
+		ride.aero,
+		ride.fric,
+		ride.wind_scaling_sqrt,
+		ride.wheel_circumference_mm,
+	])
+	writer.writerow(ISAAC_FIELDS)
+	for sample in samples(ride):
+		if sample is None:
+			continue
+		time, record, distance = sample
+		writer.writerow([
+			format_time(time),
+			'{:.2f}'.format(record.speed_mph * DEVICE_METRES_PER_MILE / 1000.0),
+			'{:.2f}'.format(ride.wind_speed_kph(record)),
+			record.power_watts,
+			'{:.3f}'.format(distance / 1000.0),
+			record.cadence,
+			record.heart_rate,
+			'{:.1f}'.format(record.elevation_metres),
+			'{:.1f}'.format(record.tilt),
+			'{:.1f}'.format(record.temperature_kelvin - 273.15),
+			record.dfpm_power_watts,
+		])
+
+EXPORTERS = {
+	'gpx': export_gpx,
+	'tcx': export_tcx,
+	'csv': export_isaac_csv,
+}
+# Formats which can't be written from the ride alone.
+NEEDS_POSITIONS = ('gpx',)
+
+def export_file(raw_filename, output_filename, format, buffer_size=1 << 16, positions=None):
+	kwargs = {}
+	if format in NEEDS_POSITIONS:
+		kwargs['positions'] = positions
+	with open(raw_filename, 'rb', buffer_size) as in_fd:
+		ride = NewtonRide.from_file(in_fd)
+		with open(output_filename, 'wb', buffer_size) as out_fd:
+			EXPORTERS[format](ride, out_fd, name=os.path.basename(raw_filename), **kwargs)
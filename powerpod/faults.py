@@ -0,0 +1,69 @@
+"""
+Line noise for the simulator, to see how well the protocol copes with it.
+
+A FaultInjector is given each packet as the device writes it, and says what goes on the wire instead, and after how long: acks may go missing, a message's checksum may be spoilt, a byte may be lost, a spurious InterruptPacket may go first, and everything is held up by latency plus up to jitter seconds. The choices come from a generator seeded with seed, so a run can be repeated exactly.
+"""
+import collections
+import random
+import time
+
+from .connection import AckPacket, CommandAckPacket, ConnectionWrapper, InterruptPacket, MessagePacket
+
+FAULTS = ('missing_ack', 'corrupt', 'drop', 'interrupt')
+ACKS = (AckPacket.INITIAL, CommandAckPacket.INITIAL)
+
+class FaultInjector(object):
+	def __init__(self, seed=0, latency=0.0, jitter=0.0, drop_rate=0.0, corrupt_rate=0.0, interrupt_rate=0.0, missing_ack_rate=0.0):
+		self.rng = random.Random(seed)
+		self.latency = latency
+		self.jitter = jitter
+		self.rates = {
+			'missing_ack': missing_ack_rate,
+			'corrupt': corrupt_rate,
+			'drop': drop_rate,
+			'interrupt': interrupt_rate,
+		}
+		self.counts = collections.Counter()
+
+	@property
+	def active(self):
+		return bool(self.latency or self.jitter or any(self.rates.values()))
+
+	def _happens(self, fault):
+		# Always draw, so that one kind of fault doesn't shift the others' choices.
+		return self.rng.random() < self.rates[fault]
+
+	def apply(self, data):
+		""" data is one packet, as written. Returns (what to send instead, seconds to hold it back). """
+		self.counts['packets'] += 1
+		if self._happens('missing_ack') and data in ACKS:
+			self.counts['missing_ack'] += 1
+			data = ''
+		if self._happens('corrupt') and data[:1] == MessagePacket.INITIAL:
+			self.counts['corrupt'] += 1
+			data = data[:-1] + chr(ord(data[-1]) ^ self.rng.randint(1, 255))
+		if self._happens('drop') and data:
+			self.counts['drop'] += 1
+			lost = self.rng.randrange(len(data))
+			data = data[:lost] + data[lost + 1:]
+		if self._happens('interrupt'):
+			self.counts['interrupt'] += 1
+			data = InterruptPacket.INITIAL + data
+		return data, self.latency + self.rng.uniform(0, self.jitter)
+
+class FaultyConnection(ConnectionWrapper):
+	"""
+	Wraps a connection (as used by NewtonSerialProtocol, which writes a packet at a time) so that what's written goes through a FaultInjector.
+	"""
+	def __init__(self, connection, faults):
+		ConnectionWrapper.__init__(self, connection)
+		self.faults = faults
+
+	def write(self, data):
+		faulty, delay = self.faults.apply(data)
+		if delay:
+			time.sleep(delay)
+		if faulty:
+			self._connection.write(faulty)
+		# As far as the writer knows, it all went.
+		return len(data)
@@ -0,0 +1,162 @@
+"""
+An SQLite index of a rides archive: every ride header field plus summary metrics, one row per .raw file.
+
+The index is updated incrementally; only rides whose size or mtime have changed are read again.
+"""
+import logging
+import os
+import os.path
+import re
+import sqlite3
+
+from .bulk import find_rides
+from .summary import ride_summary
+from .types import RIDE_FIELDS, NewtonRide
+
+LOGGER = logging.getLogger(__name__)
+
+SQL_TYPES = {'h': 'INTEGER', 'i': 'INTEGER', 'f': 'REAL', '8s': 'TEXT'}
+
+# (column, SQL type, summary key)
+SUMMARY_COLUMNS = [
+	('segments', 'INTEGER', 'segments'),
+	('duration_seconds', 'INTEGER', 'elapsed_seconds'),
+	('recorded_seconds', 'INTEGER', 'seconds'),
+	('moving_seconds', 'INTEGER', 'moving_seconds'),
+	('distance_metres', 'REAL', 'distance_metres'),
+	('work_kJ', 'REAL', 'energy_kJ'),
+	('average_power_watts', 'REAL', 'average_power_watts'),
+	('max_power_watts', 'INTEGER', 'max_power_watts'),
+	('normalized_power_watts', 'REAL', 'normalized_power_watts'),
+	('average_heart_rate', 'REAL', 'average_heart_rate'),
+	('max_heart_rate', 'INTEGER', 'max_heart_rate'),
+	('average_cadence', 'REAL', 'average_cadence'),
+	('climb_metres', 'REAL', 'climb_metres'),
+	('descent_metres', 'REAL', 'descent_metres'),
+]
+
+HEADER_COLUMNS = [(name, SQL_TYPES[shape]) for name, shape, _decode, _encode, _default in RIDE_FIELDS]
+FILE_COLUMNS = [
+	('filename', 'TEXT PRIMARY KEY'),
+	('file_size', 'INTEGER'),
+	('mtime', 'REAL'),
+	('serial_number', 'TEXT'),
+]
+COLUMNS = FILE_COLUMNS + HEADER_COLUMNS + [(name, sql_type) for name, sql_type, _key in SUMMARY_COLUMNS]
+
+DEFAULT_FILENAME = 'powerpod-index.sqlite'
+
+CONDITION = re.compile(r'^\s*(\w+)\s*(<=|>=|!=|=|<|>|like\b|is\s+not\b|is\b)\s*(.*?)\s*$', re.IGNORECASE)
+
+def parse_condition(text):
+	"""
+	Turn "column operator value" (eg. "max_power_watts > 800", "filename like %2016%", "max_power_watts is null") into (SQL, params) for query. Only the columns in COLUMNS are allowed, and the value is always a parameter, so the text can't add SQL of its own. Raises ValueError if it isn't understood.
+	"""
+	match = CONDITION.match(text)
+	if match is None:
+		raise ValueError("expected 'column operator value', got {!r}".format(text))
+	column, operator, value = match.groups()
+	if column not in set(name for name, _sql_type in COLUMNS):
+		raise ValueError("no column {!r} in the index".format(column))
+	operator = ' '.join(operator.upper().split())
+	if operator in ('IS', 'IS NOT'):
+		if value.lower() != 'null':
+			raise ValueError("{} only goes with null".format(operator))
+		return '"{}" {} NULL'.format(column, operator), []
+	if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+		value = value[1:-1]
+	else:
+		try:
+			value = float(value)
+		except ValueError:
+			pass
+	return '"{}" {} ?'.format(column, operator), [value]
+
+class RideIndex(object):
+	def __init__(self, filename):
+		self.filename = filename
+		self.db = sqlite3.connect(filename)
+		self.db.row_factory = sqlite3.Row
+		self.db.execute('CREATE TABLE IF NOT EXISTS rides ({})'.format(', '.join('"{}" {}'.format(name, sql_type) for name, sql_type in COLUMNS)))
+		existing = set(row['name'] for row in self.db.execute('PRAGMA table_info(rides)'))
+		missing = [(name, sql_type) for name, sql_type in COLUMNS if name not in existing]
+		if missing:
+			# An index from an older version; add the columns and forget the mtimes so every ride is read again.
+			for name, sql_type in missing:
+				self.db.execute('ALTER TABLE rides ADD COLUMN "{}" {}'.format(name, sql_type))
+			self.db.execute('UPDATE rides SET mtime = NULL')
+			self.db.commit()
+		# Rides without data used to get a max_power_watts of 0, as if they had some at 0W.
+		self.db.execute('UPDATE rides SET max_power_watts = NULL WHERE recorded_seconds = 0')
+		self.db.commit()
+		self.db.execute('CREATE INDEX IF NOT EXISTS rides_start_time ON rides (start_time)')
+
+	def close(self):
+		self.db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def row_for(self, directory, filename, serial_number=None):
+		path = os.path.join(directory, filename)
+		stat = os.stat(path)
+		with open(path, 'rb') as fd:
+			ride = NewtonRide.header_from_binary(fd.read(NewtonRide.byte_size()))
+		summary = ride_summary(path)
+		row = {
+			'filename': filename,
+			'file_size': stat.st_size,
+			'mtime': stat.st_mtime,
+			'serial_number': serial_number,
+		}
+		for (name, _shape, _decode, _encode, _default), value in zip(RIDE_FIELDS, ride[:-1]):
+			row[name] = value
+		row['start_time'] = ride.start_time.as_datetime().isoformat()
+		for name, _sql_type, key in SUMMARY_COLUMNS:
+			row[name] = summary[key]
+		return row
+
+	def update(self, directory, serial_number=None):
+		"""
+		Bring the index up to date with the rides in directory. serial_number, if given, is recorded against new or changed rides.
+
+		Returns (rides read, rides removed).
+		"""
+		known = {row['filename']: (row['file_size'], row['mtime'], row['serial_number']) for row in self.db.execute('SELECT filename, file_size, mtime, serial_number FROM rides')}
+		seen = set()
+		updated = 0
+		for path in find_rides(directory):
+			filename = os.path.relpath(path, directory)
+			seen.add(filename)
+			stat = os.stat(path)
+			if filename in known and known[filename][:2] == (stat.st_size, stat.st_mtime):
+				continue
+			if serial_number is None and filename in known:
+				serial = known[filename][2]
+			else:
+				serial = serial_number
+			row = self.row_for(directory, filename, serial)
+			self.db.execute(
+				'INSERT OR REPLACE INTO rides ({}) VALUES ({})'.format(', '.join('"{}"'.format(name) for name in row), ', '.join('?' * len(row))),
+				row.values(),
+			)
+			updated += 1
+		removed = set(known) - seen
+		self.db.executemany('DELETE FROM rides WHERE filename = ?', [(filename,) for filename in removed])
+		self.db.commit()
+		LOGGER.info("index updated: %s read, %s removed, %s unchanged", updated, len(removed), len(seen) - updated)
+		return updated, len(removed)
+
+	def query(self, where=None, params=(), order_by='start_time', columns=None):
+		"""
+		Return rows matching where (an SQL expression over the columns in COLUMNS) as dicts.
+		"""
+		sql = 'SELECT {} FROM rides'.format('*' if columns is None else ', '.join('"{}"'.format(column) for column in columns))
+		if where:
+			sql += ' WHERE ' + where
+		if order_by:
+			sql += ' ORDER BY ' + order_by
+		return [dict(zip(row.keys(), row)) for row in self.db.execute(sql, params)]
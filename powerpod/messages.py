@@ -292,14 +292,21 @@ class SetOdometerCommand(StructCommand, namedtuple('SetOdometerCommand', 'distan
 
 
 
+class SetSampleRateResponse(object):
+	@staticmethod
+	def from_simulator(command, simulator):
+		simulator.set_sample_seconds(command.SECONDS[command.sample_rate])
+		return None
+
 @add_command
 class SetSampleRateCommand(StructCommand, namedtuple('SetSampleRateCommand', 'unknown sample_rate')):
 	IDENTIFIER = 0x0c
 	SHAPE = '<hh'
-	RESPONSE = None
+	RESPONSE = SetSampleRateResponse
 
 	SAMPLE_RATE_1_SECOND = 0
 	SAMPLE_RATE_5_SECONDS = 1
+	SECONDS = {SAMPLE_RATE_1_SECOND: 1, SAMPLE_RATE_5_SECONDS: 5}
 
 	@staticmethod
 	def _decode(unknown, sample_rate):
@@ -1,25 +1,113 @@
-import re
+import csv
+import itertools
+
+# Rows transposed into columns at a time, so a long ride is never all held as rows.
+CHUNK_ROWS = 4096
+
+class IsaacRow(object):
+	""" A read-only view of one row of an IsaacCSV, looking like the {field: string} dict rows used to be. """
+	__slots__ = ('_csv', '_index')
+
+	def __init__(self, csv, index):
+		self._csv = csv
+		self._index = index
+
+	def __getitem__(self, field):
+		return self._csv.raw[field][self._index]
+
+	def __contains__(self, field):
+		return field in self._csv.raw
+
+	def get(self, field, default=None):
+		return self[field] if field in self else default
+
+	def keys(self):
+		return list(self._csv.fields)
+
+	def items(self):
+		return [(field, self[field]) for field in self._csv.fields]
+
+	def __iter__(self):
+		return iter(self._csv.fields)
+
+	def __repr__(self):
+		return repr(dict(self.items()))
+
+class IsaacRows(object):
+	""" The rows of an IsaacCSV as a sequence of IsaacRow, made as they're asked for. """
+	def __init__(self, csv):
+		self._csv = csv
+
+	def __len__(self):
+		return len(self._csv)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [IsaacRow(self._csv, i) for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError(index)
+		return IsaacRow(self._csv, index)
+
+	def __iter__(self):
+		for index in xrange(len(self)):
+			yield IsaacRow(self._csv, index)
 
-CSV_FIELD = re.compile(r'(?:^|(?<=,))(?:[^,"]*|"(?:[^"\\]|\\.)*")(?:(?=,)|$)')
-CSV_FIELDS = lambda line: [x[1:-1] if len(x) > 2 and x[0] == '"' else x for x in CSV_FIELD.findall(line[:-1])]
 class IsaacCSV(object):
-	def __init__(self, header, data):
+	"""
+	A ride as exported by Isaac: a few lines of header, then a row per second. header is {field: string}; raw is {field: list of strings}, a column per field in fields.
+
+	column(field) gives a field as a numpy array of floats (made once, on demand), with NaN for cells missing from short rows; data gives the rows as dict-like views, for code which wants them a row at a time.
+	"""
+	def __init__(self, header, fields, raw):
 		self.header = header
-		self.data = data
+		self.fields = fields
+		self.raw = raw
+		self._columns = {}
+
+	def __len__(self):
+		return len(self.raw[self.fields[0]]) if self.fields else 0
+
+	@property
+	def data(self):
+		return IsaacRows(self)
+
+	def column(self, field):
+		if field not in self._columns:
+			import numpy
+			values = self.raw[field]
+			if '' in values:
+				values = [float(value) if value != '' else numpy.nan for value in values]
+			self._columns[field] = numpy.array(values, dtype=numpy.float64)
+		return self._columns[field]
 
 	@classmethod
-	def from_filename(cls, filename):
-		fd = open(filename, 'r')
-		_blah = fd.readline() # boring header
-		_blah = fd.readline() # date
-		header_fields = CSV_FIELDS(fd.readline())
+	def from_fd(cls, fd):
+		reader = csv.reader(fd, escapechar='\\')
+		_blah = next(reader) # boring header
+		_blah = next(reader) # date
+		header_fields = next(reader)
 		if header_fields[0:1] == ['', '<-Weight (kg) Energy (kJ)']:
 			header_fields[0:1] = ['Weight (kg)', 'Energy (kJ)']
-		header_data = CSV_FIELDS(fd.readline())
+		header_data = next(reader)
 		header = dict(zip(header_fields, header_data))
-		ride_fields = CSV_FIELDS(fd.readline())
-		data = []
-		for line in fd:
-			data.append(dict(zip(ride_fields, CSV_FIELDS(line))))
-		return cls(header, data)
+		ride_fields = next(reader)
+		width = len(ride_fields)
+		raw = [[] for _ in ride_fields]
+		while True:
+			rows = list(itertools.islice(reader, CHUNK_ROWS))
+			if not rows:
+				break
+			if any(len(row) != width for row in rows):
+				# Short rows are missing their last cells.
+				rows = [(row + [''] * width)[:width] for row in rows]
+			# Transposed a chunk at a time, rather than a dict per row.
+			for column, values in zip(raw, zip(*rows)):
+				column.extend(values)
+		return cls(header, ride_fields, dict(zip(ride_fields, raw)))
 
+	@classmethod
+	def from_filename(cls, filename):
+		with open(filename, 'r') as fd:
+			return cls.from_fd(fd)
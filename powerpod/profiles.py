@@ -0,0 +1,67 @@
+import logging
+
+from .messages import SetProfileNumberCommand, SetProfileDataCommand, SetProfileData2Command, SetScreensCommand
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_COMMANDS = (SetProfileDataCommand, SetProfileData2Command)
+SETTABLE_FIELDS = frozenset(field for command_type in PROFILE_COMMANDS for field in command_type._fields)
+
+def profile_writes(current, wanted):
+	"""
+	The SetProfileData/SetProfileData2 commands needed to turn NewtonProfile current into wanted.
+
+	Commands are compared by their wire encoding, so eg. float noise in tilt_cal doesn't count as a change.
+	"""
+	writes = []
+	for command_type in PROFILE_COMMANDS:
+		old = command_type(*(getattr(current, field) for field in command_type._fields))
+		new = command_type(*(getattr(wanted, field) for field in command_type._fields))
+		if new.to_binary() != old.to_binary():
+			writes.append(new)
+	return writes
+
+def plan_profile_commands(current_number, profiles=None, screens=None, desired_profiles=None, desired_screens=None):
+	"""
+	Plan the commands taking the device from a snapshot to a desired state.
+
+	profiles and screens are the records of a single GetProfileDataCommand/GetAllScreensCommand; they need only be given if the matching desired state is.
+	desired_profiles maps profile number to a dict of fields to set; fields not given are left alone.
+	desired_screens maps profile number to NewtonProfileScreens.
+
+	Only writes which change something are emitted. Each profile is selected at most once, starting with the current one, and the current profile is selected again at the end if we left it.
+	"""
+	writes = {}
+	for number, fields in (desired_profiles or {}).items():
+		changed = profile_writes(profiles[number], profiles[number]._replace(**fields))
+		if changed:
+			writes.setdefault(number, []).extend(changed)
+	for number, wanted in (desired_screens or {}).items():
+		if wanted.to_binary() != screens[number].to_binary():
+			writes.setdefault(number, []).append(SetScreensCommand(wanted))
+	commands = []
+	selected = current_number
+	for number in sorted(writes, key=lambda number: (number != current_number, number)):
+		if number != selected:
+			commands.append(SetProfileNumberCommand(number))
+			selected = number
+		commands.extend(writes[number])
+	if selected != current_number:
+		commands.append(SetProfileNumberCommand(current_number))
+	LOGGER.debug("planned %r", commands)
+	return commands
+
+def run_profile_commands(protocol, commands, current_number):
+	"""
+	Send planned commands. If one fails, try to select current_number again before re-raising.
+	"""
+	selected = current_number
+	try:
+		for command in commands:
+			protocol.do_command(command)
+			if isinstance(command, SetProfileNumberCommand):
+				selected = command.number
+	except Exception:
+		if selected != current_number:
+			protocol.do_command(SetProfileNumberCommand(current_number))
+		raise
@@ -0,0 +1,76 @@
+"""
+Level-of-detail pyramids of the streams correlate.py makes for the browser extension.
+
+Each level buckets the streams by LEVELS seconds of Strava time and keeps the min, max and mean of each bucket, along with the index of the first Strava point in it (which is what the extension needs to lay the bucket back over Strava's own stream). Levels are cut into chunks of at most CHUNK_BUCKETS buckets, so the extension can show the coarsest level straight away and only fetch the finer chunks it needs.
+
+The layout written by write_pyramid is:
+
+	index.json           {"levels": [...], "chunks": {level: count}, "chunk_seconds": {level: seconds}, "types": [...], "length": points}
+	<level>-<chunk>.json {"index": [...], "time": [...], "streams": {type: {"min": [...], "max": [...], "mean": [...]}}}
+"""
+import os
+import os.path
+
+import numpy
+import simplejson
+
+from .download import write_atomically
+
+LEVELS = [1, 5, 30, 300]
+CHUNK_BUCKETS = 1200
+
+def _to_list(values):
+	return [None if numpy.isnan(value) else round(float(value), 2) for value in values]
+
+def bucket(time, streams, level):
+	"""
+	Bucket streams ({type: [value or None]}, each aligned with time) into level-second buckets. Returns (first index, bucket start time, {type: (min, max, mean)}) with the statistics as arrays, NaN for empty buckets.
+	"""
+	time = numpy.asarray(time, dtype=numpy.int64)
+	buckets = time // level
+	starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(buckets)) + 1))
+	stats = {}
+	for name, values in streams.items():
+		values = numpy.array([numpy.nan if value is None else value for value in values], dtype=numpy.float64)
+		present = ~numpy.isnan(values)
+		count = numpy.add.reduceat(present, starts)
+		total = numpy.add.reduceat(numpy.where(present, values, 0), starts)
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			mean = total / count
+		stats[name] = (numpy.fmin.reduceat(values, starts), numpy.fmax.reduceat(values, starts), mean)
+	return starts, buckets[starts] * level, stats
+
+def build_pyramid(time, streams, levels=LEVELS, chunk_buckets=CHUNK_BUCKETS):
+	"""
+	Returns (index, {filename: content}) for a pyramid of streams; see the module docstring.
+	"""
+	files = {}
+	index = {
+		'levels': sorted(levels, reverse=True),
+		'chunks': {},
+		'chunk_seconds': {},
+		'types': sorted(streams),
+		'length': len(time),
+	}
+	for level in levels:
+		starts, bucket_times, stats = bucket(time, streams, level)
+		chunks = range(0, len(starts), chunk_buckets)
+		index['chunks'][level] = len(chunks)
+		index['chunk_seconds'][level] = level * chunk_buckets
+		for number, first in enumerate(chunks):
+			part = slice(first, first + chunk_buckets)
+			files['{}-{}.json'.format(level, number)] = {
+				'index': starts[part].tolist(),
+				'time': bucket_times[part].tolist(),
+				'streams': {name: {'min': _to_list(low[part]), 'max': _to_list(high[part]), 'mean': _to_list(mean[part])} for name, (low, high, mean) in stats.items()},
+			}
+	return index, files
+
+def write_pyramid(directory, time, streams, levels=LEVELS, chunk_buckets=CHUNK_BUCKETS):
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	index, files = build_pyramid(time, streams, levels, chunk_buckets)
+	for filename, content in files.items():
+		write_atomically(os.path.join(directory, filename), simplejson.dumps(content, separators=(',', ':')))
+	# Written last, so a reader never sees an index pointing at chunks which aren't there yet.
+	write_atomically(os.path.join(directory, 'index.json'), simplejson.dumps(index, separators=(',', ':')))
@@ -0,0 +1,76 @@
+"""
+Resampling streams from different sources onto a common time grid.
+
+A Timeline is a ride as arrays: the time of each sample, and a value per sample for each stream (NaN where a sample has no value for that stream). Strava streams come at irregular times (smart recording, dropouts) and the Newton's have pauses; resample puts either onto any grid, interpolating across short gaps and leaving long ones as gaps, without making an object per second.
+"""
+import numpy
+
+METHODS = ('linear', 'nearest', 'previous')
+# Strava's smart recording leaves a few seconds between points when little is changing; longer than this is a stop.
+STRAVA_MAX_GAP = 5
+
+class Timeline(object):
+	"""
+	time is an increasing array of seconds; streams is {name: float array with a value (or NaN) at each time}.
+	"""
+	def __init__(self, time, streams):
+		self.time = numpy.asarray(time, dtype=numpy.float64)
+		self.streams = {name: numpy.asarray(values, dtype=numpy.float64) for name, values in streams.items()}
+		for name, values in self.streams.items():
+			assert len(values) == len(self.time), (name, len(values), len(self.time))
+
+	def __len__(self):
+		return len(self.time)
+
+	@classmethod
+	def from_strava(cls, streams):
+		""" From streams as the Strava API gives them, which must include time. """
+		by_type = {stream['type']: stream['data'] for stream in streams}
+		time = by_type.pop('time')
+		# Streams of pairs (latlng) don't resample.
+		return cls(time, {name: [numpy.nan if value is None else value for value in values] for name, values in by_type.items() if not values or not isinstance(values[0], list)})
+
+	@classmethod
+	def from_columns(cls, columns, names, time=None):
+		""" From a RideColumns, for the fields in names; time defaults to columns.time. """
+		return cls(columns.time if time is None else time, {name: getattr(columns, name) for name in names})
+
+	def grid(self, step=1):
+		""" Every step seconds from 0 to the end of the timeline. """
+		if not len(self):
+			return numpy.zeros(0)
+		return numpy.arange(0, self.time[-1] + step, step, dtype=numpy.float64)[:int(self.time[-1] // step) + 1]
+
+	def resample(self, grid, method='linear', max_gap=STRAVA_MAX_GAP, names=None):
+		"""
+		Returns {name: masked array of values at each time in grid}.
+
+		A grid time gets a value if there's a sample at it, or it falls between two samples at most max_gap seconds apart; it is then interpolated linearly, or takes the nearest (the earlier on a tie) or the previous sample's value, as method says. Other grid times are masked.
+		"""
+		assert method in METHODS, method
+		grid = numpy.asarray(grid, dtype=numpy.float64)
+		resampled = {}
+		for name in (self.streams if names is None else names):
+			values = self.streams[name]
+			present = ~numpy.isnan(values)
+			time = self.time[present]
+			values = values[present]
+			if not len(time):
+				resampled[name] = numpy.ma.masked_all(len(grid))
+				continue
+			# The last sample at or before each grid time, and the one after it.
+			before = numpy.searchsorted(time, grid, side='right') - 1
+			after = numpy.minimum(before + 1, len(time) - 1)
+			safe_before = numpy.maximum(before, 0)
+			exact = (before >= 0) & (time[safe_before] == grid)
+			bridged = (before >= 0) & (before + 1 < len(time)) & (time[after] - time[safe_before] <= max_gap)
+			valid = exact | bridged
+			if method == 'linear':
+				out = numpy.interp(grid, time, values)
+			elif method == 'nearest':
+				nearer_after = (time[after] - grid) < (grid - time[safe_before])
+				out = numpy.where(nearer_after & ~exact, values[after], values[safe_before])
+			else:
+				out = values[safe_before]
+			resampled[name] = numpy.ma.array(out, mask=~valid)
+		return resampled
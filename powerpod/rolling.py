@@ -0,0 +1,100 @@
+"""
+Rolling windows over a ride, by time or by distance, for derived streams like average slope or smoothed power.
+
+A RollingWindow keeps the samples whose position (seconds, or metres ridden) is within size of the latest one, with running totals and monotonic deques, so each sample costs O(1) amortised whatever the window size. RollingStream describes a derived stream declaratively; rolling_streams computes any number of them in one pass over a ride.
+"""
+from collections import deque, namedtuple
+
+class RollingWindow(object):
+	"""
+	add(position, value, weight) samples in order of position; samples at or before position - size drop out. weight is what the sample stands for (eg. metres ridden during it) and is what integral and mean are weighted by.
+	"""
+	def __init__(self, size):
+		self.size = size
+		self.reset()
+
+	def reset(self):
+		self.samples = deque()
+		self.count = 0
+		self.added = 0
+		self.total = 0.0
+		self.weight = 0.0
+		self.integral = 0.0
+		# (serial, value), values increasing (for the minimum) or decreasing (for the maximum) from the front.
+		self.minimums = deque()
+		self.maximums = deque()
+
+	def add(self, position, value, weight=1.0):
+		serial = self.added
+		self.added += 1
+		self.samples.append((serial, position, value, weight))
+		self.count += 1
+		self.total += value
+		self.weight += weight
+		self.integral += value * weight
+		while self.minimums and self.minimums[-1][1] >= value:
+			self.minimums.pop()
+		self.minimums.append((serial, value))
+		while self.maximums and self.maximums[-1][1] <= value:
+			self.maximums.pop()
+		self.maximums.append((serial, value))
+		while self.samples[0][1] <= position - self.size:
+			old_serial, _old_position, old_value, old_weight = self.samples.popleft()
+			self.count -= 1
+			self.total -= old_value
+			self.weight -= old_weight
+			self.integral -= old_value * old_weight
+			if self.minimums[0][0] == old_serial:
+				self.minimums.popleft()
+			if self.maximums[0][0] == old_serial:
+				self.maximums.popleft()
+
+	@property
+	def sum(self):
+		return self.total
+
+	@property
+	def mean(self):
+		""" Weighted by weight. """
+		return self.integral / self.weight if self.weight else None
+
+	@property
+	def minimum(self):
+		return self.minimums[0][1] if self.minimums else None
+
+	@property
+	def maximum(self):
+		return self.maximums[0][1] if self.maximums else None
+
+AGGREGATES = ('sum', 'mean', 'integral', 'minimum', 'maximum')
+
+class RollingStream(namedtuple('RollingStream', 'value size by aggregate minimum_weight')):
+	"""
+	value(columns) (a RideColumns) gives an array with a value per record, which is aggregated over the last size seconds (by='time') or metres (by='distance'). The stream is None until the window's weight (seconds, or metres, with data) reaches minimum_weight.
+	"""
+	def __new__(cls, value, size, by='time', aggregate='mean', minimum_weight=0):
+		assert by in ('time', 'distance'), by
+		assert aggregate in AGGREGATES, aggregate
+		return super(RollingStream, cls).__new__(cls, value, size, by, aggregate, minimum_weight)
+
+def rolling_streams(definitions, columns):
+	"""
+	Returns {name: list with a value (or None) per record of columns} for the {name: RollingStream} definitions, in one pass over the ride.
+	"""
+	windows = {name: RollingWindow(definition.size) for name, definition in definitions.items()}
+	values = {name: definition.value(columns).tolist() for name, definition in definitions.items()}
+	output = {name: [] for name in definitions}
+	# Each record stands for a second of riding.
+	steps = columns.speed_metres_per_second.tolist()
+	distance = 0.0
+	for index, second in enumerate(columns.time.tolist()):
+		step = steps[index]
+		distance += step
+		for name, definition in definitions.items():
+			window = windows[name]
+			if definition.by == 'time':
+				window.add(second, values[name][index])
+			else:
+				window.add(distance, values[name][index], step)
+			output[name].append(getattr(window, definition.aggregate) if window.weight >= definition.minimum_weight else None)
+	return output
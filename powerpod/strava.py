@@ -0,0 +1,116 @@
+"""
+Fetching activity streams from Strava, with an on-disk cache, or from saved files for working offline.
+
+Streams are as the streams API returns them: a list of {'type': ..., 'data': [...], ...}, one per stream type.
+"""
+import logging
+import os
+import os.path
+import time
+
+import simplejson
+
+from .download import write_atomically
+
+LOGGER = logging.getLogger(__name__)
+
+STREAMS_URL = 'https://www.strava.com/api/v3/activities/{activity_id}/streams/{types}?access_token={token}'
+DEFAULT_TOKEN_FILE = '~/.strava-token'
+DEFAULT_CACHE_DIRECTORY = '~/.powerpod-strava-cache'
+DEFAULT_TYPES = ('time', 'distance', 'cadence', 'heartrate', 'velocity_smooth')
+
+def read_token(filename=DEFAULT_TOKEN_FILE):
+	with open(os.path.expanduser(filename), 'r') as fd:
+		return fd.read().strip()
+
+def cache_filename(directory, activity_id, types):
+	return os.path.join(directory, '{}.{}.json'.format(activity_id, '_'.join(sorted(types))))
+
+def only_types(streams, types):
+	return [stream for stream in streams if stream['type'] in types]
+
+class StreamProvider(object):
+	def get_streams(self, activity_id, types=DEFAULT_TYPES):
+		raise NotImplementedError
+
+class FileStreamProvider(StreamProvider):
+	"""
+	Streams saved in directory, either as <activity id>.json, or as left there by a CachingStreamProvider for any set of stream types including those wanted.
+	"""
+	def __init__(self, directory):
+		self.directory = directory
+
+	def candidates(self, activity_id, types):
+		yield os.path.join(self.directory, '{}.json'.format(activity_id))
+		prefix = '{}.'.format(activity_id)
+		for filename in sorted(os.listdir(self.directory)):
+			if filename.startswith(prefix) and filename.endswith('.json') and set(types) <= set(filename[len(prefix):-len('.json')].split('_')):
+				yield os.path.join(self.directory, filename)
+
+	def get_streams(self, activity_id, types=DEFAULT_TYPES):
+		for filename in self.candidates(activity_id, types):
+			if os.path.exists(filename):
+				with open(filename, 'r') as fd:
+					saved = simplejson.load(fd)
+				# Cache entries wrap the streams with their validators.
+				return only_types(saved['streams'] if isinstance(saved, dict) else saved, types)
+		raise IOError("no saved streams for activity {} in {}".format(activity_id, self.directory))
+
+class CachingStreamProvider(StreamProvider):
+	"""
+	Fetches from the Strava API, keeping a copy of each (activity, stream set) in cache_directory.
+
+	A cached copy younger than max_age seconds is used as is; an older one is revalidated with its ETag/Last-Modified, so an unchanged activity costs a 304 rather than the streams. If Strava can't be reached, a cached copy is used however old it is.
+
+	opener is what requests go through (anything with urllib2's OpenerDirector.open); the default is urllib2.build_opener().
+	"""
+	def __init__(self, token=None, cache_directory=DEFAULT_CACHE_DIRECTORY, max_age=0, opener=None):
+		self.token = token
+		self.cache_directory = os.path.expanduser(cache_directory)
+		self.max_age = max_age
+		self.opener = opener
+
+	def get_streams(self, activity_id, types=DEFAULT_TYPES):
+		import urllib2
+		filename = cache_filename(self.cache_directory, activity_id, types)
+		cached = None
+		if os.path.exists(filename):
+			with open(filename, 'r') as fd:
+				cached = simplejson.load(fd)
+			if time.time() - cached['fetched'] < self.max_age:
+				return cached['streams']
+		if self.token is None:
+			self.token = read_token()
+		request = urllib2.Request(STREAMS_URL.format(activity_id=activity_id, types=','.join(types), token=self.token))
+		if cached is not None:
+			if cached.get('etag'):
+				request.add_header('If-None-Match', cached['etag'])
+			if cached.get('last_modified'):
+				request.add_header('If-Modified-Since', cached['last_modified'])
+		try:
+			response = (self.opener or urllib2.build_opener()).open(request)
+		except urllib2.HTTPError as e:
+			if e.code == 304 and cached is not None:
+				LOGGER.debug("streams for %s not modified", activity_id)
+				cached['fetched'] = time.time()
+				self._store(filename, cached)
+				return cached['streams']
+			raise
+		except urllib2.URLError as e:
+			if cached is None:
+				raise
+			LOGGER.warning("can't reach Strava (%s); using streams cached at %s", e.reason, time.ctime(cached['fetched']))
+			return cached['streams']
+		streams = simplejson.load(response)
+		self._store(filename, {
+			'fetched': time.time(),
+			'etag': response.info().getheader('ETag'),
+			'last_modified': response.info().getheader('Last-Modified'),
+			'streams': streams,
+		})
+		return streams
+
+	def _store(self, filename, entry):
+		if not os.path.isdir(self.cache_directory):
+			os.makedirs(self.cache_directory)
+		write_atomically(filename, simplejson.dumps(entry))
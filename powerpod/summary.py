@@ -0,0 +1,126 @@
+"""
+Summary metrics for a ride, computed with numpy over its RideColumns, and cached next to the ride.
+
+The cache (ride.metrics.json) is only trusted if it was written by the same METRICS_VERSION with the same zones, from a ride file of the same size and mtime. Bump METRICS_VERSION whenever a metric changes meaning. Other per-ride analyses can cache themselves the same way with cached.
+"""
+import logging
+import os
+import os.path
+
+import numpy
+import simplejson
+
+from .columns import RideColumns
+from .download import write_atomically
+
+LOGGER = logging.getLogger(__name__)
+
+METRICS_VERSION = 2
+CACHE_SUFFIX = '.metrics.json'
+
+# Lower bounds of each zone. Power zones are Coggan's for a 250W FTP; heart rate zones are a rough five zone split.
+POWER_ZONES = [0, 138, 188, 225, 263, 300, 375]
+HEART_RATE_ZONES = [0, 114, 133, 152, 171]
+
+# Below this (in mph) we're not moving, whatever stopped_flag_maybe says.
+MOVING_SPEED_MPH = 1.0
+NORMALIZED_POWER_WINDOW = 30
+# The header's energy_kJ is rounded; only complain about a bigger difference than this.
+ENERGY_TOLERANCE_KJ = 2.0
+
+def _round(value, places=1):
+	return None if value is None else round(float(value), places)
+
+def _time_in_zones(values, zones):
+	return numpy.bincount(numpy.searchsorted(zones, values, side='right') - 1, minlength=len(zones)).tolist()
+
+def normalized_power(power, segments, window=NORMALIZED_POWER_WINDOW):
+	"""
+	Fourth root of the mean fourth power of the window-second rolling average of power. Windows never span a pause; segments shorter than window don't count.
+	"""
+	rolling = []
+	for segment in segments:
+		if segment.stop - segment.start < window:
+			continue
+		cumulative = numpy.concatenate(([0], numpy.cumsum(power[segment], dtype=numpy.float64)))
+		rolling.append((cumulative[window:] - cumulative[:-window]) / window)
+	if not rolling:
+		return None
+	return numpy.mean(numpy.concatenate(rolling) ** 4) ** 0.25
+
+def summarise(columns, power_zones=POWER_ZONES, heart_rate_zones=HEART_RATE_ZONES):
+	"""
+	Returns a dict of summary metrics for the RideColumns columns; all values are plain JSON-able numbers.
+	"""
+	header = columns.header
+	start_time = header.start_time.as_datetime()
+	seconds = len(columns)
+	segments = list(columns.segments())
+	power = columns.power_watts
+	heart_rate = columns.heart_rate[columns.heart_rate > 0]
+	cadence = columns.cadence[columns.cadence > 0]
+	moving = (columns.speed_mph >= MOVING_SPEED_MPH) & (columns.stopped_flag_maybe == 0)
+	climb = descent = 0.0
+	for segment in segments:
+		steps = numpy.diff(columns.elevation_metres[segment])
+		climb += steps[steps > 0].sum()
+		descent -= steps[steps < 0].sum()
+	energy_kJ = power.sum() / 1000.0
+	energy_mismatch = abs(energy_kJ - header.energy_kJ) > ENERGY_TOLERANCE_KJ
+	if energy_mismatch:
+		LOGGER.warning("ride at %s: records add up to %.1fkJ, but the header says %.1fkJ", start_time, energy_kJ, header.energy_kJ)
+	return {
+		'start_time': start_time.isoformat(),
+		'segments': len(segments),
+		'seconds': seconds,
+		'elapsed_seconds': int(columns.time[-1]) + 1 if seconds else 0,
+		'moving_seconds': int(moving.sum()),
+		'distance_metres': _round(columns.speed_metres_per_second.sum()),
+		'energy_kJ': _round(energy_kJ),
+		'header_energy_kJ': _round(header.energy_kJ),
+		'energy_mismatch': bool(energy_mismatch),
+		'average_power_watts': _round(power.mean()) if seconds else None,
+		'max_power_watts': int(power.max()) if seconds else None,
+		'normalized_power_watts': _round(normalized_power(power, segments)),
+		'average_dfpm_power_watts': _round(columns.dfpm_power_watts.mean()) if seconds else None,
+		'average_heart_rate': _round(heart_rate.mean()) if heart_rate.size else None,
+		'max_heart_rate': int(heart_rate.max()) if heart_rate.size else None,
+		'average_cadence': _round(cadence.mean()) if cadence.size else None,
+		'max_cadence': int(cadence.max()) if cadence.size else None,
+		'climb_metres': _round(climb),
+		'descent_metres': _round(descent),
+		'power_zone_seconds': _time_in_zones(power, power_zones),
+		'heart_rate_zone_seconds': _time_in_zones(heart_rate, heart_rate_zones),
+	}
+
+def cached(raw_filename, suffix, version, parameters, compute):
+	"""
+	Return compute(RideColumns for raw_filename), caching it as JSON in a file next to the ride whose name ends in suffix. The cache is used only if version, parameters (JSON-able) and the ride's size and mtime are unchanged.
+	"""
+	stat = os.stat(raw_filename)
+	key = {
+		'version': version,
+		'file_size': stat.st_size,
+		'mtime': stat.st_mtime,
+		'parameters': parameters,
+	}
+	filename = os.path.splitext(raw_filename)[0] + suffix
+	if os.path.exists(filename):
+		with open(filename, 'r') as fd:
+			try:
+				cache = simplejson.load(fd)
+			except ValueError:
+				cache = {}
+		if cache.get('key') == key:
+			return cache['value']
+	value = compute(RideColumns.from_filename(raw_filename))
+	try:
+		write_atomically(filename, simplejson.dumps({'key': key, 'value': value}, sort_keys=True))
+	except (IOError, OSError) as e:
+		LOGGER.warning("can't cache %s for %s: %s", suffix, raw_filename, e)
+	return value
+
+def ride_summary(raw_filename, power_zones=POWER_ZONES, heart_rate_zones=HEART_RATE_ZONES):
+	""" summarise the ride in raw_filename, using or refreshing its cache. """
+	parameters = {'power_zones': list(power_zones), 'heart_rate_zones': list(heart_rate_zones)}
+	return cached(raw_filename, CACHE_SUFFIX, METRICS_VERSION, parameters, lambda columns: summarise(columns, power_zones, heart_rate_zones))
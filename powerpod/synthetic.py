@@ -0,0 +1,212 @@
+"""
+Synthetic rides for the simulator, generated on demand so that it can pretend to be a device full of long rides without holding them in memory.
+
+A ride is made of BLOCK_SECONDS blocks of riding taken from a small set of templates, which are generated (and encoded) once per seed and sample rate. Which templates a ride uses, and how long it is, come from a random generator seeded with the seed and the ride's number, so the same ride always has the same bytes. A ride's header only needs each block's totals, and its body is the templates' bytes strung together with pause records between, so neither costs a pass over every record; the body is only put together as it's sent (see RideStream).
+
+The device records every second or every 5 seconds (see SetSampleRateCommand); sample_seconds is which.
+"""
+import datetime
+import random
+import struct
+
+from .types import DEVICE_METRES_PER_MILE, PAUSE_TAG, RECORD_SIZE, RIDE_DEFAULTS, NewtonRide, NewtonRideData, NewtonRideHeader, NewtonTime
+
+BLOCK_SECONDS = 300
+TEMPLATES = 16
+FIRST_START_TIME = datetime.datetime(2016, 1, 1, 8, 0, 0)
+BASE_ELEVATION_FEET = 300
+
+def encode_pause(time):
+	return struct.pack('<6s8sb', PAUSE_TAG, NewtonTime.from_datetime(time).to_binary(), 0)
+
+def _clamp(value, low, high):
+	return max(low, min(high, value))
+
+class Template(object):
+	"""
+	BLOCK_SECONDS of riding, with a record every sample_seconds: data is the encoded records, and power, speed and temperature are running totals (with a leading 0) so any leading part of the block can be summed at once.
+	"""
+	def __init__(self, rng, sample_seconds=1):
+		# A random walk for the elevation, pulled back so the block starts and ends at BASE_ELEVATION_FEET and blocks join up.
+		walk = [0.0]
+		for _ in range(BLOCK_SECONDS - 1):
+			walk.append(walk[-1] + rng.gauss(0, 0.8))
+		drift = walk[-1] / max(BLOCK_SECONDS - 1, 1)
+		elevations = [int(round(BASE_ELEVATION_FEET + height - drift * second)) for second, height in enumerate(walk)]
+		records = []
+		self.power = [0]
+		self.speed = [0.0]
+		self.temperature = [0]
+		speed = rng.uniform(12, 24)
+		temperature = rng.randint(45, 75)
+		# The ride is worked out every second whatever the sample rate, so a seed's templates are the same ride sampled more or less often.
+		for second in range(BLOCK_SECONDS):
+			climb = elevations[min(second + 1, BLOCK_SECONDS - 1)] - elevations[second]
+			tilt = round(_clamp(climb * 100.0 / max(speed * DEVICE_METRES_PER_MILE / 3600.0 / 0.3048, 1), -15, 15), 1)
+			speed = round(_clamp(speed + rng.gauss(0, 0.3) - tilt * 0.05, 3, 45), 1)
+			cadence = int(_clamp(rng.gauss(85, 5), 0, 140))
+			power = int(_clamp(120 + 30 * tilt + 6 * (speed - 15) + rng.gauss(0, 30), 0, 1500))
+			heart_rate = int(_clamp(100 + power / 5 + rng.gauss(0, 2), 60, 200))
+			# Near enough the ride header's default calibration for speed in still air.
+			wind = int(_clamp(610 + (speed * 1.602) ** 2 * 0.09 + rng.gauss(0, 3), 0, 1023))
+			if second % sample_seconds:
+				continue
+			records.append(NewtonRideData(elevations[second], cadence, heart_rate, temperature, 0, tilt, speed, wind, power, power, 0, 0, 5).to_binary())
+			self.power.append(self.power[-1] + power)
+			self.speed.append(self.speed[-1] + speed)
+			self.temperature.append(self.temperature[-1] + temperature)
+		self.data = ''.join(records)
+
+class SyntheticRides(object):
+	"""
+	The templates for a seed, and rides made from them. seconds is a ride's length in seconds of riding, or (shortest, longest); pause_every seconds of riding (if set), the ride pauses for pause_seconds.
+	"""
+	def __init__(self, seed=0, seconds=3600, pause_every=0, pause_seconds=60):
+		rng = random.Random(seed)
+		self.seed = seed
+		self.seconds = seconds if isinstance(seconds, tuple) else (seconds, seconds)
+		self.pause_every = pause_every
+		self.pause_seconds = pause_seconds
+		self._templates = {}
+
+	def templates(self, sample_seconds):
+		if sample_seconds not in self._templates:
+			assert BLOCK_SECONDS % sample_seconds == 0, sample_seconds
+			rng = random.Random(self.seed)
+			self._templates[sample_seconds] = [Template(rng, sample_seconds) for _ in range(TEMPLATES)]
+		return self._templates[sample_seconds]
+
+	def ride(self, number, sample_seconds=1):
+		return SyntheticRide(self, number, sample_seconds)
+
+	def rides(self, count, sample_seconds=1):
+		return [self.ride(number, sample_seconds) for number in range(count)]
+
+class SyntheticRide(object):
+	""" Looks enough like a NewtonRide for the simulator: get_header and to_binary. """
+	def __init__(self, rides, number, sample_seconds=1):
+		rng = random.Random(rides.seed * 1000003 + number)
+		self.rides = rides
+		self.number = number
+		self.sample_seconds = sample_seconds
+		self.seconds = rng.randint(*rides.seconds)
+		# A record for each sample_seconds of riding, and one for any left over.
+		self.data_records = -(-self.seconds // sample_seconds)
+		self.block_records = BLOCK_SECONDS // sample_seconds
+		self.blocks = [rng.randrange(TEMPLATES) for _ in range(-(-self.data_records // self.block_records))]
+		self.start_time = FIRST_START_TIME + datetime.timedelta(days=number)
+
+	@property
+	def pause_every_records(self):
+		""" Data records between pauses, or 0 for none. """
+		if not self.rides.pause_every:
+			return 0
+		return max(self.rides.pause_every // self.sample_seconds, 1)
+
+	@property
+	def pauses(self):
+		if not self.pause_every_records:
+			return 0
+		return (self.data_records - 1) // self.pause_every_records
+
+	@property
+	def byte_size(self):
+		return NewtonRide.byte_size() + (self.data_records + self.pauses) * RECORD_SIZE
+
+	def _block_lengths(self):
+		""" (template, records of it used) for each block. """
+		templates = self.rides.templates(self.sample_seconds)
+		for index, template in enumerate(self.blocks):
+			yield templates[template], min(self.block_records, self.data_records - index * self.block_records)
+
+	def _totals(self):
+		power = speed = temperature = 0
+		for template, length in self._block_lengths():
+			power += template.power[length]
+			speed += template.speed[length]
+			temperature += template.temperature[length]
+		return power, speed, temperature
+
+	@property
+	def header(self):
+		""" The NewtonRide header (records is None). """
+		power, speed, temperature = self._totals()
+		size = self.data_records + self.pauses
+		fields = dict(RIDE_DEFAULTS)
+		fields.update(
+			size=size,
+			energy_kJ=int(round(power * self.sample_seconds / 1000.0)),
+			average_temperature_farenheit=int(round(float(temperature) / size)) if size else fields['average_temperature_farenheit'],
+			initial_elevation_feet=BASE_ELEVATION_FEET,
+			start_time=NewtonTime.from_datetime(self.start_time),
+			unknown_2=self.sample_seconds,
+			records=None,
+		)
+		return NewtonRide(**fields)
+
+	def get_header(self):
+		_power, speed, _temperature = self._totals()
+		return NewtonRideHeader(RIDE_DEFAULTS['unknown_0'], NewtonTime.from_datetime(self.start_time), speed * self.sample_seconds * DEVICE_METRES_PER_MILE / 3600.0)
+
+	def iter_binary(self):
+		""" Yield the ride's bytes a piece at a time: the header, then runs of records. """
+		header = self.header
+		yield struct.pack(NewtonRide.SHAPE, *header._encode())
+		pause_every = self.pause_every_records
+		time = self.start_time
+		ridden = 0
+		for template, length in self._block_lengths():
+			start = 0
+			while start < length:
+				if pause_every and ridden and ridden % pause_every == 0:
+					time += datetime.timedelta(seconds=self.rides.pause_seconds)
+					yield encode_pause(time)
+				end = length if not pause_every else min(length, start + pause_every - ridden % pause_every)
+				yield template.data[start * RECORD_SIZE:end * RECORD_SIZE]
+				time += datetime.timedelta(seconds=(end - start) * self.sample_seconds)
+				ridden += end - start
+				start = end
+
+	def to_binary(self):
+		""" The ride's bytes as a RideStream, which can be sliced and measured like a string. """
+		return RideStream(self)
+
+class RideStream(object):
+	"""
+	A ride's bytes, put together from iter_binary as they're asked for rather than all at once: slices are expected to move forward through the ride (as a response is sent 63 bytes at a time), and only what's between the last slice and the next is held. Going back starts again from the beginning.
+	"""
+	def __init__(self, ride):
+		self.ride = ride
+		self.size = ride.byte_size
+		self._restart()
+
+	def _restart(self):
+		self.pieces = self.ride.iter_binary()
+		self.buffer = ''
+		self.offset = 0
+
+	def __len__(self):
+		return self.size
+
+	def __str__(self):
+		return ''.join(self.ride.iter_binary())
+
+	def __getitem__(self, index):
+		if not isinstance(index, slice):
+			return self[index:index + 1]
+		start, stop, step = index.indices(self.size)
+		assert step == 1, step
+		if start < self.offset:
+			self._restart()
+		while len(self.buffer) < stop - self.offset:
+			piece = next(self.pieces, None)
+			if piece is None:
+				break
+			self.buffer += piece
+		# Forget what's been sent.
+		self.buffer = self.buffer[start - self.offset:]
+		self.offset = start
+		return self.buffer[:max(stop - start, 0)]
+
+	def __getslice__(self, start, stop):
+		return self[slice(max(start, 0), max(stop, 0))]
@@ -329,7 +329,17 @@ RIDE_DATA_FIELDS = [
 # Using 'set profile after the ride' seems to ignore both unknown_0 and acceleration_maybe. I guess they are internal values, but I can only guess what they might do.
 assert sum(x[1] for x in RIDE_DATA_FIELDS) == 15 * 8
 DECODE_FIFTEEN_BYTES = '{:08b}' * 15
-ENCODE_FIFTEEN_BYTES = ''.join('{:0%sb}' % (fielddef[1],) for fielddef in RIDE_DATA_FIELDS)
+def wind_tube_speed_kph(wind_tube_pressure_difference, density, offset=621, multiplier=13.6355, wind_scaling_sqrt=1.0):
+	""" Air speed from the wind tube, for one record or (given numpy arrays) a whole column; a difference below offset is still air. """
+	# multiplier based on solving from CSV file
+	difference = wind_tube_pressure_difference - offset
+	difference = difference * (difference > 0)
+	return (difference / density * multiplier) ** 0.5 * wind_scaling_sqrt
+
+# A record starting with this is a NewtonRideDataPaused.
+PAUSE_TAG = '\xff' * 6
+# Not a real mile (1609.344 m): the device works out a ride's distance (as in NewtonRideHeader) with this, and Isaac's speeds and distances agree with it, so we use it too.
+DEVICE_METRES_PER_MILE = 1602
 class NewtonRideData(object):
 	SHAPE = '15s'
 	__slots__ = zip(*RIDE_DATA_FIELDS)[0]
@@ -344,7 +354,7 @@ class NewtonRideData(object):
 
 	@classmethod
 	def from_binary(cls, data):
-		if data.startswith('\xff\xff\xff\xff\xff\xff'):
+		if data.startswith(PAUSE_TAG):
 			return NewtonRideDataPaused.from_binary(data)
 		binary = DECODE_FIFTEEN_BYTES.format(*struct.unpack('15B', data))
 		vals = []
@@ -356,14 +366,13 @@ class NewtonRideData(object):
 		return cls(*vals)
 
 	def to_binary(self):
-		vals = []
+		# Shift the fields into one 120 bit number, rather than going through a string of '0's and '1's.
+		number = 0
 		for name, size, _decode, encode in RIDE_DATA_FIELDS:
-			value = getattr(self, name)
-			vals.append(encode(value))
-		binary = ENCODE_FIFTEEN_BYTES.format(*vals)
-		assert len(binary) == 15 * 8
-		chopped = [int(binary[x:x+8], 2) for x in range(0, 15*8, 8)]
-		return struct.pack('15B', *chopped)
+			value = encode(getattr(self, name))
+			assert 0 <= value < 1 << size, (name, value)
+			number = (number << size) | value
+		return ('%030x' % number).decode('hex')
 
 	@property
 	def elevation_metres(self):
@@ -382,14 +391,13 @@ class NewtonRideData(object):
 		return self.pressure_Pa(reference_pressure_Pa, reference_temperature_kelvin) * 0.0289644 / 8.31447 / self.temperature_kelvin
 
 	def wind_speed_kph(self, offset=621, multiplier=13.6355, reference_pressure_Pa=101325, reference_temperature_kelvin=288.15, wind_scaling_sqrt=1.0):
-		# multiplier based on solving from CSV file
-		if self.wind_tube_pressure_difference < offset:
-			return 0.0
-		return ((self.wind_tube_pressure_difference - offset) / self.density(reference_pressure_Pa, reference_temperature_kelvin) * multiplier) ** 0.5 * wind_scaling_sqrt
+		return wind_tube_speed_kph(self.wind_tube_pressure_difference, self.density(reference_pressure_Pa, reference_temperature_kelvin), offset, multiplier, wind_scaling_sqrt)
 
 	def __repr__(self):
 		return '{}({})'.format(self.__class__.__name__, ', '.join(repr(getattr(self, name)) for name in self.__slots__))
 
+RECORD_SIZE = NewtonRideData.byte_size()
+
 class NewtonRideDataPaused(StructType, namedtuple('NewtonRideDataPaused', 'tag newton_time unknown_3')):
 	SHAPE = '<6s8sb'
 
@@ -411,7 +419,7 @@ RIDE_FIELDS = [
 	('elevation_gain_feet', 'f', IDENTITY, IDENTITY, 0), # byte 26, always integer?!
 	('wheel_circumference_mm', 'f', IDENTITY, IDENTITY, 2136.0), # byte 30, always integer?!
 	('unknown_1', 'h', IDENTITY, IDENTITY, 15), # byte 34, 0x0f00 and 0x0e00 and 0x0e00 observed; multiplying by 10 does nothing observable. TODO is this ftp per kilo ish?
-	('unknown_2', 'h', IDENTITY, IDENTITY, 1), # byte 36, =1?
+	('unknown_2', 'h', IDENTITY, IDENTITY, 1), # byte 36, =1? Rides recorded every second have shown 1; it might be the seconds between records, so the simulator's rides (see powerpod.synthetic) have 5 here when recorded every 5 seconds.
 	('start_time', '8s', NewtonTime.from_binary, NewtonTime.to_binary, NewtonTime(0, 0, 0, 1, 1, 31, 2000)), # byte 38
 	('pressure_Pa', 'i', IDENTITY, IDENTITY, 101325), # byte 46, appears to be pressure in Pa (observed range 100121-103175) # (setting, reported) = [(113175, 1113), (103175, 1014), (93175, 915), (203175, 1996), (1e9, 9825490), (2e9, 19650979), (-2e9, -19650979)]. Reported value in Isaac (hPa) is this divided by ~101.7761 or multiplied by 0.00982549. This isn't affected by truncating the ride at all. It /is/ affected by unknown_3; if I make unknown_3 -73 from 73, I get (-2e9, -19521083).
 	('Cm', 'f', IDENTITY, IDENTITY, 1.0204), # byte 50
@@ -473,12 +481,49 @@ class NewtonRide(StructListType, namedtuple('NewtonRide', zip(*RIDE_FIELDS)[0] +
 	def _decode(*args):
 		return tuple(decode(val) for val, decode in zip(args, RIDE_DECODE))
 
+	@classmethod
+	def header_from_binary(cls, data):
+		""" Decode just the header; records is None. """
+		return cls(*(cls._decode(*struct.unpack(cls.SHAPE, data)) + (None,)))
+
+	@classmethod
+	def from_file(cls, fd):
+		"""
+		Like from_binary, but only the header is read up front. records is an iterator which reads and decodes records from fd as it's consumed, so a ride of any length can be processed in constant memory.
+		"""
+		ride = cls.header_from_binary(fd.read(cls.byte_size()))
+		record_size = cls.RECORD_TYPE.byte_size()
+		def records():
+			for _ in range(ride.size):
+				yield cls.RECORD_TYPE.from_binary(fd.read(record_size))
+		return ride._replace(records=records())
+
+	def timed_records(self):
+		"""
+		Yield (datetime, record) for each data record. Records are a second apart, except that a pause record sets the time of the next one.
+		"""
+		time = self.start_time.as_datetime()
+		for record in self.records:
+			if hasattr(record, 'newton_time'):
+				time = record.newton_time.as_datetime()
+				continue
+			yield time, record
+			time += datetime.timedelta(seconds=1)
+
+	def wind_calibration(self):
+		""" This ride's calibration, as keyword arguments for NewtonRideData.wind_speed_kph (or RideColumns'). """
+		return dict(offset=self.wind_tube_pressure_offset - 10, reference_pressure_Pa=self.reference_pressure_Pa, reference_temperature_kelvin=self.reference_temperature_kelvin, wind_scaling_sqrt=self.wind_scaling_sqrt)
+
+	def wind_speed_kph(self, record):
+		""" Air speed of record, using this ride's calibration. """
+		return record.wind_speed_kph(**self.wind_calibration())
+
 	def get_header(self):
-		return NewtonRideHeader(self.unknown_0, self.start_time, sum(x.speed_mph * 1602 / 3600. for x in self.records if isinstance(x, NewtonRideData)))
+		return NewtonRideHeader(self.unknown_0, self.start_time, sum(x.speed_mph * DEVICE_METRES_PER_MILE / 3600. for x in self.records if isinstance(x, NewtonRideData)))
 
 	def fit_to(self, csv):
 		pure_records = [x for x in self.records if not hasattr(x, 'newton_time')]
-		csv_data = [float(x['Wind Speed (km/hr)']) for x in csv.data]
+		csv_data = csv.column('Wind Speed (km/hr)').tolist()
 		compare = [(x, y) for x, y in zip(pure_records, csv_data) if y > 0]
 		reference_pressure_kPa = self.reference_pressure_Pa / 1000.0
 		get_errors = lambda offset, multiplier: [pure_record.wind_speed_kph(offset, multiplier, reference_pressure_kPa, self.reference_temperature_kelvin, self.wind_scaling_sqrt) - csv_datum for pure_record, csv_datum in compare]
@@ -509,7 +554,7 @@ class NewtonRide(StructListType, namedtuple('NewtonRide', zip(*RIDE_FIELDS)[0] +
 
 	def fit_elevation(self, csv):
 		pure_records = [x for x in self.records if not hasattr(x, 'newton_time')]
-		csv_data = [float(x['Elevation (meters)']) / 0.3048 for x in csv.data]
+		csv_data = (csv.column('Elevation (meters)') / 0.3048).tolist()
 		compare = [(x, y) for x, y in zip(pure_records, csv_data)]
 		get_errors = lambda mul: [(pure_record.density(), pure_record.elevation_feet, csv_datum, pure_record.elevation_feet - csv_datum, (pure_record.wind_tube_pressure_difference - self.wind_tube_pressure_offset), pure_record.tilt, pure_record.unknown_0, pure_record) for pure_record, csv_datum in compare]
 		return get_errors(0.1)
@@ -0,0 +1,160 @@
+"""
+Checking the ride decoder against Isaac's CSV exports of the same rides.
+
+Each .raw file with an Isaac CSV next to it (the same name, ending .csv) is decoded with RideColumns and compared, field by field, with what Isaac made of it; a row of the CSV is a data record of the ride. For each field we count the values out by more than its tolerance, and keep the mean, RMS and largest error. A baseline of these can be saved, and later runs report any ride and field which has got worse since, so a decoder change can be checked over a whole archive at once.
+"""
+import logging
+import multiprocessing
+import os.path
+
+import numpy
+import simplejson
+
+from .bulk import find_rides
+from .columns import RideColumns
+from .download import write_atomically
+from .misc import IsaacCSV
+
+LOGGER = logging.getLogger(__name__)
+
+# (CSV field, our value as an expression over RideColumns, tolerance); tolerances allow for Isaac's rounding.
+FIELDS = [
+	('Speed (km/hr)', lambda ride: ride.speed_metres_per_second * 3.6, 0.006),
+	('Wind Speed (km/hr)', lambda ride: ride.air_speed_kph(), 0.006),
+	('Power (W)', lambda ride: ride.power_watts, 0.5),
+	('Distance (km)', lambda ride: numpy.cumsum(ride.speed_metres_per_second) / 1000.0, 0.001),
+	('Cadence (RPM)', lambda ride: ride.cadence, 0.5),
+	('Heartrate (BPM)', lambda ride: ride.heart_rate, 0.5),
+	('Elevation (meters)', lambda ride: ride.elevation_metres, 0.051),
+	('Hill slope (%)', lambda ride: ride.tilt, 0.051),
+	('Temperature (C)', lambda ride: ride.temperature_kelvin - 273.15, 0.051),
+	('DFPM Power', lambda ride: ride.dfpm_power_watts, 0.5),
+]
+STATISTICS = ('count', 'over', 'sum_abs', 'sum_squares', 'max_abs')
+# Float noise between runs isn't a regression.
+SLACK = 1e-9
+
+def find_pairs(directory):
+	""" (raw filename, CSV filename) for each ride under directory with an Isaac CSV beside it. """
+	pairs = []
+	for raw_filename in find_rides(directory):
+		csv_filename = os.path.splitext(raw_filename)[0] + '.csv'
+		if os.path.exists(csv_filename):
+			pairs.append((raw_filename, csv_filename))
+	return pairs
+
+def compare(ride, csv):
+	"""
+	Compare a RideColumns with an IsaacCSV. Returns {field: {statistic: value}} for the FIELDS the CSV has, plus the number of records and CSV rows.
+	"""
+	length = min(len(ride), len(csv))
+	fields = {}
+	for field, expression, tolerance in FIELDS:
+		if field not in csv.raw:
+			continue
+		errors = numpy.abs(numpy.asarray(expression(ride), dtype=numpy.float64)[:length] - csv.column(field)[:length])
+		fields[field] = {
+			'count': int(length),
+			'over': int((errors > tolerance).sum()),
+			'sum_abs': float(errors.sum()),
+			'sum_squares': float((errors ** 2).sum()),
+			'max_abs': float(errors.max()) if length else 0.0,
+		}
+	return {'records': len(ride), 'rows': len(csv), 'fields': fields}
+
+def compare_files(pair):
+	""" compare for a (raw filename, CSV filename); returns (raw filename, result, error). """
+	raw_filename, csv_filename = pair
+	try:
+		return raw_filename, compare(RideColumns.from_filename(raw_filename), IsaacCSV.from_filename(csv_filename)), None
+	except Exception as e:
+		return raw_filename, None, '{}: {}'.format(e.__class__.__name__, e)
+
+def totals(results):
+	""" Add up the per-ride results ({ride: compare result}) into {field: statistics}. """
+	combined = {}
+	for result in results.values():
+		for field, statistics in result['fields'].items():
+			total = combined.setdefault(field, dict.fromkeys(STATISTICS, 0))
+			for name in STATISTICS:
+				total[name] = max(total[name], statistics[name]) if name == 'max_abs' else total[name] + statistics[name]
+	return combined
+
+def regressions(results, baseline):
+	""" Descriptions of each (ride, field) which is worse in results than in baseline, and each ride which has started failing. """
+	found = []
+	for ride, result in sorted(results.items()):
+		before = baseline.get(ride)
+		if before is None:
+			continue
+		if result is None:
+			found.append('{}: now fails to compare'.format(ride))
+			continue
+		if result['records'] != before['records'] or result['rows'] != before['rows']:
+			found.append('{}: {} records against {} rows, was {} against {}'.format(ride, result['records'], result['rows'], before['records'], before['rows']))
+		for field, statistics in sorted(result['fields'].items()):
+			old = before['fields'].get(field)
+			if old is None:
+				continue
+			if statistics['over'] > old['over']:
+				found.append('{}: {}: {} values out of tolerance, was {}'.format(ride, field, statistics['over'], old['over']))
+			elif statistics['sum_abs'] > old['sum_abs'] + SLACK * max(1, statistics['count']):
+				found.append('{}: {}: mean error {:.6f}, was {:.6f}'.format(ride, field, statistics['sum_abs'] / statistics['count'], old['sum_abs'] / old['count']))
+	return found
+
+class Validation(object):
+	"""
+	results is {ride: compare result, or None if it failed}, rides being the .raw filenames relative to the directory; errors is {ride: message} for those which failed.
+	"""
+	def __init__(self, results, errors):
+		self.results = results
+		self.errors = errors
+
+	@property
+	def totals(self):
+		return totals({ride: result for ride, result in self.results.items() if result is not None})
+
+	def regressions(self, baseline):
+		return regressions(self.results, baseline['rides'])
+
+	def to_baseline(self):
+		return {'rides': {ride: result for ride, result in self.results.items() if result is not None}, 'totals': self.totals}
+
+	def report(self):
+		""" A line per field: values compared, values out of tolerance, mean, RMS and largest error. """
+		lines = ['{:<22} {:>10} {:>8} {:>10} {:>10} {:>10}'.format('field', 'values', 'over', 'mean', 'rms', 'max')]
+		for field, _expression, _tolerance in FIELDS:
+			total = self.totals.get(field)
+			if total is None or not total['count']:
+				continue
+			lines.append('{:<22} {:>10} {:>8} {:>10.4f} {:>10.4f} {:>10.4f}'.format(
+				field, total['count'], total['over'], total['sum_abs'] / total['count'], (total['sum_squares'] / total['count']) ** 0.5, total['max_abs'],
+			))
+		return '\n'.join(lines)
+
+def validate(directory, processes=None, chunk_size=4):
+	""" Compare every ride under directory with its Isaac CSV, using a pool of processes. Returns a Validation. """
+	pairs = find_pairs(directory)
+	LOGGER.info("comparing %d rides with their CSVs", len(pairs))
+	pool = multiprocessing.Pool(processes)
+	try:
+		compared = pool.map(compare_files, pairs, chunk_size)
+	finally:
+		pool.close()
+		pool.join()
+	results = {}
+	errors = {}
+	for raw_filename, result, error in compared:
+		ride = os.path.relpath(raw_filename, directory)
+		results[ride] = result
+		if error is not None:
+			LOGGER.warning("%s: %s", ride, error)
+			errors[ride] = error
+	return Validation(results, errors)
+
+def load_baseline(filename):
+	with open(filename, 'r') as fd:
+		return simplejson.load(fd)
+
+def save_baseline(filename, validation):
+	write_atomically(filename, simplejson.dumps(validation.to_baseline(), sort_keys=True))
@@ -0,0 +1,116 @@
+# Measures how well the host side of the protocol copes with line noise: downloads rides from a simulated device whose output goes through a FaultInjector, and reports goodput and how long each failure took to recover from.
+# python protocol-benchmark.py [--downloads N] [--drop-rate R] [--corrupt-rate R] [--interrupt-rate R] [--missing-ack-rate R] [--latency S] [--jitter S]
+
+import argparse
+import collections
+import logging
+import sys
+import threading
+import time
+
+import powerpod
+from powerpod.faults import FaultInjector
+from powerpod.synthetic import SyntheticRides
+
+import simulator
+
+class BoundedConnection(powerpod.ConnectionWrapper):
+	"""
+	NewtonSerialProtocol waits forever (timeout None) for a reply; with packets going missing that would hang, so wait at most longest seconds instead.
+	"""
+	def __init__(self, connection, longest):
+		powerpod.ConnectionWrapper.__init__(self, connection)
+		self.longest = longest
+
+	@powerpod.ConnectionWrapper.timeout.setter
+	def timeout(self, value):
+		self._connection.timeout = self.longest if value is None else min(value, self.longest)
+
+def start_device(args):
+	source = SyntheticRides(seed=args.seed, seconds=args.ride_seconds)
+	device = simulator.SimulatedDevice('-'.join(['00'] * 16), 200, make_rides=lambda sample_seconds: source.rides(args.rides, sample_seconds))
+	faults = FaultInjector(
+		seed=args.fault_seed,
+		latency=args.latency,
+		jitter=args.jitter,
+		drop_rate=args.drop_rate,
+		corrupt_rate=args.corrupt_rate,
+		interrupt_rate=args.interrupt_rate,
+		missing_ack_rate=args.missing_ack_rate,
+	)
+	fleet = simulator.FleetSimulator([device], [faults])
+	thread = threading.Thread(target=fleet.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return fleet, thread, faults
+
+def recover(connection, settle):
+	""" Let anything still on its way arrive, and throw it away. """
+	time.sleep(settle)
+	connection.reset_input_buffer()
+
+def arg_parser():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--downloads', default=20, type=int, help='number of rides to download')
+	parser.add_argument('--rides', default=5, type=int, help='number of rides on the device (downloaded in turn)')
+	parser.add_argument('--ride-seconds', default=600, type=int)
+	parser.add_argument('--seed', default=0, type=int)
+	parser.add_argument('--reply-timeout', default=1.0, type=float, help='longest to wait for a reply before giving up on a command')
+	parser.add_argument('--attempts', default=20, type=int, help='give up on a ride after this many failures')
+	parser.add_argument('--time-limit', default=60.0, type=float, help='give up on the rides not yet downloaded after this many seconds')
+	faults = parser.add_argument_group('faults', 'as for simulator.py')
+	faults.add_argument('--latency', default=0.0, type=float)
+	faults.add_argument('--jitter', default=0.0, type=float)
+	faults.add_argument('--drop-rate', default=0.0, type=float)
+	faults.add_argument('--corrupt-rate', default=0.0, type=float)
+	faults.add_argument('--interrupt-rate', default=0.0, type=float)
+	faults.add_argument('--missing-ack-rate', default=0.0, type=float)
+	faults.add_argument('--fault-seed', default=0, type=int)
+	return parser
+
+def main():
+	logging.basicConfig(level=logging.CRITICAL)
+	args = arg_parser().parse_args()
+	fleet, thread, faults = start_device(args)
+	connection = BoundedConnection(powerpod.NewtonSerialConnection(port=fleet.ports[0]), args.reply_timeout)
+	protocol = powerpod.NewtonSerialProtocol(connection, device_side=False)
+	settle = args.reply_timeout + args.latency + args.jitter
+	received = 0
+	downloaded = 0
+	errors = collections.Counter()
+	recoveries = []
+	start = time.time()
+	for download in range(args.downloads):
+		if time.time() - start > args.time_limit:
+			sys.stdout.write('time limit reached\n')
+			break
+		command = powerpod.GetFileCommand(download % args.rides)
+		failed_at = None
+		for _attempt in range(args.attempts):
+			try:
+				ride = protocol.do_command(command).ride_data
+			except Exception as e:
+				errors[e.__class__.__name__] += 1
+				if failed_at is None:
+					failed_at = time.time()
+				recover(connection, settle)
+				if time.time() - start > args.time_limit:
+					break
+				continue
+			received += len(ride.to_binary())
+			downloaded += 1
+			if failed_at is not None:
+				recoveries.append(time.time() - failed_at)
+			break
+	elapsed = time.time() - start
+	fleet.shutdown()
+	thread.join()
+	sys.stdout.write('downloads        {} ({} given up on)\n'.format(args.downloads, args.downloads - downloaded))
+	sys.stdout.write('goodput          {:.1f} kB/s ({} bytes in {:.2f} s)\n'.format(received / elapsed / 1000, received, elapsed))
+	sys.stdout.write('failures         {}\n'.format(', '.join('{} {}'.format(name, count) for name, count in sorted(errors.items())) or 'none'))
+	if recoveries:
+		sys.stdout.write('recovery         {} times, mean {:.2f} s, worst {:.2f} s\n'.format(len(recoveries), sum(recoveries) / len(recoveries), max(recoveries)))
+	sys.stdout.write('faults injected  {}\n'.format(', '.join('{} {}'.format(name, count) for name, count in sorted(faults.counts.items())) or 'none'))
+
+if __name__ == '__main__':
+	main()
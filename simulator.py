@@ -1,82 +1,456 @@
 import threading
 import logging
 import argparse
+import collections
+import errno
+import os
+import select
+import sys
+import time
+import tty
 
 import powerpod
 
 LOGGER = logging.getLogger(__name__)
 
-class NewtonSimulator(threading.Thread):
+class ResponseCache(object):
+	"""
+	Encoded responses, by the message they answer, in groups which a command can invalidate together. Least recently used responses are dropped beyond max_bytes, so a device with many long rides doesn't end up holding them all.
+	"""
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.entries = collections.OrderedDict()
+
+	def get(self, group, message):
+		response = self.entries.pop((group, message), None)
+		if response is not None:
+			self.entries[group, message] = response
+		return response
+
+	def put(self, group, message, response):
+		self.entries[group, message] = response
+		self.size += len(response)
+		while self.size > self.max_bytes and self.entries:
+			_key, dropped = self.entries.popitem(last=False)
+			self.size -= len(dropped)
+
+	def invalidate(self, groups=None):
+		for key in list(self.entries):
+			if groups is None or key[0] in groups:
+				self.size -= len(self.entries.pop(key))
+
+# Responses worth keeping, by command identifier, with the state they come from.
+CACHED_RESPONSES = {
+	powerpod.GetFileCommand.IDENTIFIER: 'rides',
+	powerpod.GetFileListCommand.IDENTIFIER: 'rides',
+	powerpod.GetProfileDataCommand.IDENTIFIER: 'profiles',
+	powerpod.GetAllScreensCommand.IDENTIFIER: 'screens',
+}
+# Commands which change that state.
+INVALIDATES = {
+	powerpod.EraseAllCommand.IDENTIFIER: ['rides'],
+	powerpod.SetProfileDataCommand.IDENTIFIER: ['profiles'],
+	powerpod.SetProfileData2Command.IDENTIFIER: ['profiles'],
+	powerpod.SetScreensCommand.IDENTIFIER: ['screens'],
+	powerpod.SetSampleRateCommand.IDENTIFIER: ['rides'],
+}
+CACHE_BYTES = 64 << 20
+
+class SimulatedDevice(object):
+	"""
+	The state of a pretend device, which commands' get_response reads and changes. respond() turns a message from the host into the bytes to send back.
+	"""
 	firmware_version = 6.12
-	def __init__(self, serial_number, clip_length, serial_connection=None):
-		super(NewtonSimulator, self).__init__()
-		if serial_connection is None:
-			serial_connection = powerpod.NewtonSerialConnection()
-		self.serial_connection = serial_connection
+	def __init__(self, serial_number, clip_length, make_rides=None, label='', sample_seconds=1):
+		"""
+		make_rides(sample_seconds) returns the rides on the device, recorded every sample_seconds; the default is one short ride. (See powerpod.synthetic for lots of long ones.) label goes at the start of log lines.
+		"""
+		self.make_rides = make_rides
+		self.sample_seconds = sample_seconds
 		self.serial_number = serial_number
 		self.clip_length = clip_length
-		self.protocol = None
+		self.label = label
 		self.profiles = None
 		self.current_profile = 0
 		self.odometer_distance = 100.0
 		self.units_type = powerpod.SetUnitsCommand.METRIC
 		self.screens = [powerpod.NewtonProfileScreens.default() for _ in range(4)]
-		self.reload = False
+		self.last_identifier = 0x09 # skip first firmware
+		self.response_cache = ResponseCache(CACHE_BYTES)
 		self.init()
 
+	def init(self):
+		self.response_cache.invalidate()
+		self.profiles = [powerpod.types.NewtonProfile.default() for _ in range(4)]
+		if self.make_rides is not None:
+			self.rides = self.make_rides(self.sample_seconds)
+		else:
+			self.rides = [
+				powerpod.types.NewtonRide.make(
+					[powerpod.types.NewtonRideData(10, 0, 100, 100, 0, 0.0, 10.0, 620, 100, 200, x - 100 if x >= 100 and x < 200 else 0, 1, 5) for x in range(1000)]
+				)
+			]
+
+	def set_sample_seconds(self, sample_seconds):
+		""" As SetSampleRateCommand. The rides stand for whatever the device has recorded, so they're made again at the new rate. """
+		self.sample_seconds = sample_seconds
+		if self.make_rides is not None:
+			self.rides = self.make_rides(sample_seconds)
+
+	def respond(self, message):
+		""" The response to message, or None if the command just wants acknowledging. """
+		identifier = ord(message[0])
+		data = message[1:]
+		command = powerpod.NewtonCommand.MAP[identifier].parse(data)
+		if (identifier, self.last_identifier) in [(0x09, 0x0e), (0x0e, 0x09)]:
+			# Newton sends get firmware/get serial every second or so
+			# Log these as debug messages.
+			log = LOGGER.debug
+			self.last_identifier = identifier
+		else:
+			log = LOGGER.info
+		log("%s<- %r", self.label, command)
+		group = CACHED_RESPONSES.get(identifier)
+		if group is not None:
+			response_bin = self.response_cache.get(group, message)
+			if response_bin is not None:
+				log("%s-> (%d bytes, cached)", self.label, len(response_bin))
+				return response_bin
+		response = command.get_response(self)
+		log("%s-> %s", self.label, repr(response)[:self.clip_length])
+		response_bin = None if response is None else response.to_binary()
+		if identifier in INVALIDATES:
+			self.response_cache.invalidate(INVALIDATES[identifier])
+		# A mapped file (see powerpod.archive) or a ride put together as it's sent (see powerpod.synthetic) is cheap to send again; keeping it would only crowd out the rest.
+		if group is not None and isinstance(response_bin, str):
+			self.response_cache.put(group, message, response_bin)
+		return response_bin
+
+class NewtonSimulator(SimulatedDevice, threading.Thread):
+	""" One device on a serial connection, served by a thread of its own. """
+	def __init__(self, serial_number, clip_length, serial_connection=None, make_rides=None, faults=None, sample_seconds=1):
+		threading.Thread.__init__(self)
+		if serial_connection is None:
+			serial_connection = powerpod.NewtonSerialConnection()
+		if faults is not None and faults.active:
+			from powerpod.faults import FaultyConnection
+			serial_connection = FaultyConnection(serial_connection, faults)
+		self.serial_connection = serial_connection
+		self.protocol = None
+		self.reload = False
+		SimulatedDevice.__init__(self, serial_number, clip_length, make_rides=make_rides, sample_seconds=sample_seconds)
+
 	def do_reload(self):
 		self.reload = False
 		reload(powerpod)
 		self.init()
 
 	def init(self):
-		self.profiles = [powerpod.types.NewtonProfile.default() for _ in range(4)]
-		self.rides = [
-			powerpod.types.NewtonRide.make(
-				[powerpod.types.NewtonRideData(10, 0, 100, 100, 0, 0.0, 10.0, 620, 100, 200, x - 100 if x >= 100 and x < 200 else 0, 1, 5) for x in range(1000)]
-			)
-		]
+		SimulatedDevice.init(self)
 		self.protocol = powerpod.NewtonSerialProtocol(self.serial_connection)
 
 	def run(self):
-		last_identifier = 0x09 # skip first firmware
 		with self.serial_connection:
 			while True:
 				if self.reload:
 					self.do_reload()
 					break
 				message = self.protocol.read_message()
-				identifier = ord(message[0])
-				data = message[1:]
-				command = powerpod.NewtonCommand.MAP[identifier].parse(data)
-				if (identifier, last_identifier) in [(0x09, 0x0e), (0x0e, 0x09)]:
-					# Newton sends get firmware/get serial every second or so
-					# Log these as debug messages.
-					log = LOGGER.debug
-					last_identifier = identifier
-				else:
-					log = LOGGER.info
-				log("<- %r", command)
-				response = command.get_response(self)
-				log("-> %s", repr(response)[:self.clip_length])
-				response_bin = None if response is None else response.to_binary()
-				self.protocol.write_message(response_bin)
+				self.protocol.write_message(self.respond(message))
+
+class DeviceProtocol(object):
+	"""
+	The device's side of NewtonSerialProtocol, driven by bytes as they arrive rather than by blocking reads, so that one thread can serve many devices. feed() takes bytes from the host and returns the packets (as bytes) to send back.
+	"""
+	# As NewtonSerialProtocol waits for the host to ack a ReadyPacket.
+	READY_ACK_TIMEOUT = 5
+	# NewtonSerialProtocol waits forever for a message part's ack; a lost ack would leave the device stuck, so give up after this long.
+	PART_ACK_TIMEOUT = 5
+
+	def __init__(self, device):
+		self.device = device
+		self.buffer = ''
+		self.message_parts = []
+		self.expect_message = False
+		# The response being written, how much has been sent, and which ack we're waiting for ('ready' or 'part').
+		self.response = None
+		self.sent = 0
+		self.waiting_for = None
+		self.deadline = None
+
+	def feed(self, data, now):
+		self.buffer += data
+		out = []
+		while True:
+			packet = self._next_packet(out)
+			if packet is None:
+				break
+			LOGGER.debug("%sreceived_packet %r", self.device.label, packet)
+			if self.waiting_for is None:
+				self._read(packet, out, now)
+			else:
+				self._write(packet, out, now)
+		return out
+
+	def poll(self, now):
+		""" Packets to send because a deadline has passed. """
+		if self.waiting_for is not None and now >= self.deadline:
+			LOGGER.warning("%sunexpected_write_%s None", self.device.label, 'ready' if self.waiting_for == 'ready' else 'ack')
+			self._finish()
+			return [powerpod.InterruptPacket().wire_value]
+		return []
+
+	def _next_packet(self, out):
+		""" Take the next whole packet from the buffer, or None if there isn't one yet; rubbish is answered with an InterruptPacket. """
+		while self.buffer:
+			packet_type = powerpod.Packet.PACKET_TYPES.get(self.buffer[0])
+			if packet_type is None:
+				LOGGER.warning("%sinvalid_packet %r", self.device.label, self.buffer[0])
+				self.buffer = self.buffer[1:]
+				out.append(powerpod.InterruptPacket().wire_value)
+				continue
+			length = 1
+			while True:
+				remain = packet_type.read_length(self.buffer[:length])
+				if remain is None or remain <= 0:
+					break
+				if length + remain > len(self.buffer):
+					return None
+				length += remain
+			data, self.buffer = self.buffer[:length], self.buffer[length:]
+			packet = packet_type.parse(data)
+			if packet is None:
+				LOGGER.warning("%sinvalid_packet %r", self.device.label, data)
+				out.append(powerpod.InterruptPacket().wire_value)
+				continue
+			return packet
+		return None
+
+	def _read(self, packet, out, now):
+		if isinstance(packet, powerpod.InterruptPacket):
+			# As read_message, the host has given up; start again without answering.
+			LOGGER.warning("%sunexpected_read_conversation %r", self.device.label, [packet])
+			self.expect_message = False
+			return
+		if not self.expect_message:
+			if isinstance(packet, powerpod.ReadyPacket):
+				out.append(powerpod.AckPacket().wire_value)
+				self.expect_message = True
+			else:
+				LOGGER.warning("%sunexpected_read_conversation %r", self.device.label, [packet])
+				out.append(powerpod.InterruptPacket().wire_value)
+			return
+		self.expect_message = False
+		if not isinstance(packet, powerpod.MessagePacket):
+			LOGGER.warning("%sunexpected_read_conversation %r", self.device.label, [packet])
+			out.append(powerpod.InterruptPacket().wire_value)
+			return
+		self.message_parts.append(packet)
+		if not packet.terminal:
+			out.append(powerpod.AckPacket().wire_value)
+			return
+		out.append(powerpod.CommandAckPacket().wire_value)
+		message = ''.join(part.data for part in self.message_parts)
+		self.message_parts = []
+		response = self.device.respond(message)
+		if response is None:
+			out.append(powerpod.CommandAckPacket().wire_value)
+			return
+		self.response = response
+		self.sent = 0
+		self._send_ready(out, now)
+
+	def _send_ready(self, out, now):
+		out.append(powerpod.ReadyPacket().wire_value)
+		self.waiting_for = 'ready'
+		self.deadline = now + self.READY_ACK_TIMEOUT
+
+	def _write(self, packet, out, now):
+		if not isinstance(packet, powerpod.AckPacket):
+			LOGGER.warning("%sunexpected_write_%s %r", self.device.label, 'ready' if self.waiting_for == 'ready' else 'ack', packet)
+			if not isinstance(packet, powerpod.InterruptPacket):
+				out.append(powerpod.InterruptPacket().wire_value)
+			self._finish()
+			return
+		if self.waiting_for == 'ready':
+			out.append(powerpod.MessagePacket(self.response[self.sent:self.sent + 63]).wire_value)
+			self.waiting_for = 'part'
+			self.deadline = now + self.PART_ACK_TIMEOUT
+			return
+		# As write_message, a response which is a multiple of 63 bytes ends with an empty part.
+		self.sent += 63
+		if self.sent > len(self.response):
+			self._finish()
+		else:
+			self._send_ready(out, now)
+
+	def _finish(self):
+		self.response = None
+		self.waiting_for = None
+		self.deadline = None
+
+class FleetSimulator(object):
+	"""
+	Many devices, each on a pseudo-terminal of its own (see ports), all served by one thread with select. faults, if given, has a FaultInjector (or None) for each device, which everything the device sends goes through.
+	"""
+	def __init__(self, devices, faults=None):
+		self.protocols = {}
+		self.faults = {}
+		self.slaves = []
+		self.ports = []
+		for device, device_faults in zip(devices, faults or [None] * len(devices)):
+			master, slave = os.openpty()
+			tty.setraw(slave)
+			# Held open, so the master doesn't see a hang up between clients.
+			self.slaves.append(slave)
+			self.ports.append(os.ttyname(slave))
+			self.protocols[master] = DeviceProtocol(device)
+			if device_faults is not None and device_faults.active:
+				self.faults[master] = device_faults
+		# (time due, bytes) to send to each master, in order.
+		self.pending = dict((master, collections.deque()) for master in self.protocols)
+		# Written to by shutdown(), to wake serve_forever.
+		self.wake_read, self.wake_write = os.pipe()
+
+	def shutdown(self):
+		""" Make serve_forever return. """
+		os.write(self.wake_write, '\0')
+
+	def _send(self, master, packets, now):
+		queue = self.pending[master]
+		faults = self.faults.get(master)
+		for packet in packets:
+			due = now
+			if faults is not None:
+				packet, delay = faults.apply(packet)
+				# Held back packets still go in order.
+				due = max(now + delay, queue[-1][0]) if queue else now + delay
+			if packet:
+				queue.append((due, packet))
+
+	def serve_forever(self):
+		pending = self.pending
+		while True:
+			now = time.time()
+			deadlines = [protocol.deadline for protocol in self.protocols.values() if protocol.deadline is not None]
+			deadlines.extend(queue[0][0] for queue in pending.values() if queue)
+			timeout = max(min(deadlines) - now, 0) if deadlines else None
+			readable, writable, _ = select.select(list(self.protocols) + [self.wake_read], [master for master, queue in pending.items() if queue and queue[0][0] <= now], [], timeout)
+			now = time.time()
+			if self.wake_read in readable:
+				return
+			for master in readable:
+				try:
+					data = os.read(master, 1 << 16)
+				except OSError as e:
+					if e.errno != errno.EIO:
+						raise
+					continue
+				self._send(master, self.protocols[master].feed(data, now), now)
+			for master, protocol in self.protocols.items():
+				self._send(master, protocol.poll(now), now)
+			for master in writable:
+				queue = pending[master]
+				data = []
+				while queue and queue[0][0] <= now:
+					data.append(queue.popleft()[1])
+				data = ''.join(data)
+				written = os.write(master, data)
+				if written < len(data):
+					queue.appendleft((now, data[written:]))
+
+def make_serial_number(base, index):
+	""" base (as --serial-number) with index added to its last bytes. """
+	number = int(base.replace('-', ''), 16) + index
+	digits = '{:032X}'.format(number % (1 << 128))
+	return '-'.join(digits[i:i + 2] for i in range(0, 32, 2))
 
 def arg_parser():
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--port')
 	parser.add_argument('--serial-number', default='-'.join(['00'] * 16))
 	parser.add_argument('--clip-length', default=200, type=int, help='maximum length of (sent) debug output')
+	parser.add_argument('--devices', type=int, help='serve this many devices, each on a pseudo-terminal of its own, from one thread; their ports are printed')
+	parser.add_argument('--sample-rate', default=1, type=int, choices=sorted(powerpod.SetSampleRateCommand.SECONDS.values()), help='seconds between records, until the host sends SetSampleRateCommand')
+	parser.add_argument('--rides-dir', help='serve the .raw files in this directory (as downloaded by get_all_rides) as the rides on the device')
+	scale = parser.add_argument_group('scale mode', 'pretend to hold lots of long rides, generated as they are asked for')
+	scale.add_argument('--rides', type=int, help='number of rides')
+	scale.add_argument('--ride-seconds', default='3600', type=seconds_range, help='length of each ride, or a range (eg. 1800-36000)')
+	scale.add_argument('--pause-every', default=0, type=int, help='pause after this many seconds of riding')
+	scale.add_argument('--pause-seconds', default=60, type=int, help='length of each pause')
+	scale.add_argument('--seed', default=0, type=int, help='the same seed gives the same rides (each device adds its number)')
+	faults = parser.add_argument_group('faults', 'spoil what the device sends, to see how the host copes; rates are per packet')
+	faults.add_argument('--latency', default=0.0, type=float, help='seconds to hold back each packet')
+	faults.add_argument('--jitter', default=0.0, type=float, help='up to this many more seconds, at random')
+	faults.add_argument('--drop-rate', default=0.0, type=float, help='chance of losing a byte of a packet')
+	faults.add_argument('--corrupt-rate', default=0.0, type=float, help='chance of spoiling a message\'s checksum')
+	faults.add_argument('--interrupt-rate', default=0.0, type=float, help='chance of a spurious interrupt before a packet')
+	faults.add_argument('--missing-ack-rate', default=0.0, type=float, help='chance of not sending an ack')
+	faults.add_argument('--fault-seed', default=0, type=int, help='the same seed gives the same faults (each device adds its number)')
 	return parser
 
+def seconds_range(string):
+	if '-' in string:
+		shortest, longest = string.split('-', 1)
+		return int(shortest), int(longest)
+	return int(string)
+
+def rides_maker(args, index=0):
+	if args.rides_dir is not None:
+		from powerpod.archive import archive_rides
+		return lambda _sample_seconds: archive_rides(args.rides_dir)
+	if args.rides is None:
+		return None
+	from powerpod.synthetic import SyntheticRides
+	source = SyntheticRides(seed=args.seed + index, seconds=args.ride_seconds, pause_every=args.pause_every, pause_seconds=args.pause_seconds)
+	return lambda sample_seconds: source.rides(args.rides, sample_seconds)
+
+def fault_injector(args, index=0):
+	from powerpod.faults import FaultInjector
+	return FaultInjector(
+		seed=args.fault_seed + index,
+		latency=args.latency,
+		jitter=args.jitter,
+		drop_rate=args.drop_rate,
+		corrupt_rate=args.corrupt_rate,
+		interrupt_rate=args.interrupt_rate,
+		missing_ack_rate=args.missing_ack_rate,
+	)
+
+def log_faults(label, faults):
+	if faults.active:
+		LOGGER.info("%sfaults %s", label, ', '.join('{} {}'.format(name, count) for name, count in sorted(faults.counts.items())))
+
 def main():
 	logging.basicConfig(level=logging.INFO)
 	args = arg_parser().parse_args()
+	if args.devices is not None:
+		devices = []
+		faults = []
+		for index in range(args.devices):
+			serial_number = make_serial_number(args.serial_number, index)
+			devices.append(SimulatedDevice(serial_number, args.clip_length, make_rides=rides_maker(args, index), label='[{}] '.format(serial_number), sample_seconds=args.sample_rate))
+			faults.append(fault_injector(args, index))
+		fleet = FleetSimulator(devices, faults)
+		for device, port in zip(devices, fleet.ports):
+			print '{} {}'.format(device.serial_number, port)
+		sys.stdout.flush()
+		try:
+			fleet.serve_forever()
+		except KeyboardInterrupt:
+			for device, device_faults in zip(devices, faults):
+				log_faults(device.label, device_faults)
+		return
 	kwargs = {}
 	if args.port is not None:
 		kwargs['serial_connection'] = powerpod.NewtonSerialConnection(port=args.port)
-	sim = NewtonSimulator(serial_number=args.serial_number, clip_length=args.clip_length, **kwargs)
-	sim.run()
+	faults = fault_injector(args)
+	sim = NewtonSimulator(serial_number=args.serial_number, clip_length=args.clip_length, make_rides=rides_maker(args), faults=faults, sample_seconds=args.sample_rate, **kwargs)
+	try:
+		sim.run()
+	except KeyboardInterrupt:
+		log_faults('', faults)
 
 if __name__ == '__main__':
 	main()
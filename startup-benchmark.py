@@ -0,0 +1,98 @@
+# Times how long short commands take to start, and checks that nothing slow is imported before it's needed.
+# python startup-benchmark.py [--runs N]
+
+import argparse
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import powerpod
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules which should only be imported by the commands which need them.
+LAZY_MODULES = (
+	'serial', 'simplejson', 'urllib2', 'SocketServer', 'numpy', 'sqlite3',
+	'powerpod.daemon', 'powerpod.download', 'powerpod.bulk', 'powerpod.export', 'powerpod.index',
+	# The numpy users.
+	'powerpod.alignment', 'powerpod.columns', 'powerpod.curve', 'powerpod.extradata', 'powerpod.pyramid', 'powerpod.resample', 'powerpod.summary', 'powerpod.validate',
+)
+
+CHECK_IMPORTS = """
+import imp, sys
+imp.load_source('powerpod_command', {!r})
+sys.stdout.write(' '.join(name for name in {!r} if name in sys.modules))
+"""
+# `import powerpod` shouldn't load any of its submodules; they're imported when something in them is first used.
+CHECK_PACKAGE = """
+import sys
+import powerpod
+sys.stdout.write(' '.join(sorted(name for name, module in sys.modules.items() if name.startswith('powerpod.') and module is not None)))
+"""
+
+def start_simulator(rides):
+	""" A simulated device for the commands which need one; returns (process, port). """
+	process = subprocess.Popen([sys.executable, os.path.join(HERE, 'simulator.py'), '--devices', '1', '--rides', str(rides)], stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'), cwd=HERE)
+	_serial_number, port = process.stdout.readline().split()
+	return process, port
+
+def time_command(argv, runs):
+	times = []
+	with open(os.devnull, 'w') as devnull:
+		for _ in range(runs):
+			start = time.time()
+			subprocess.check_call(argv, stdout=devnull, cwd=HERE)
+			times.append(time.time() - start)
+	return sorted(times)
+
+def make_ride(directory, seconds):
+	filename = os.path.join(directory, 'benchmark.raw')
+	records = [powerpod.types.NewtonRideData(10, 90, 140, 100, 0, 0.0, 20.0, 700, 200, 200, 0, 0, 5) for _ in range(seconds)]
+	with open(filename, 'wb') as fd:
+		fd.write(powerpod.NewtonRide.make(records).to_binary())
+	return filename
+
+def arg_parser():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--runs', default=20, type=int)
+	parser.add_argument('--ride-seconds', default=600, type=int, help='length of the ride used for the offline decode case')
+	parser.add_argument('--rides', default=50, type=int, help='number of rides on the simulated device for list_rides')
+	return parser
+
+def main():
+	args = arg_parser().parse_args()
+	directory = tempfile.mkdtemp()
+	simulator, port = start_simulator(args.rides)
+	command = os.path.join(HERE, 'powerpod-command')
+	try:
+		raw_filename = make_ride(directory, args.ride_seconds)
+		cases = [
+			('interpreter', [sys.executable, '-c', 'pass']),
+			('import powerpod', [sys.executable, '-c', 'import powerpod']),
+			('powerpod-command --help', [sys.executable, command, '--help']),
+			('decode_ride', [sys.executable, command, 'decode_ride ' + raw_filename]),
+			('list_rides ({} rides)'.format(args.rides), [sys.executable, command, '--port', port, 'list_rides']),
+		]
+		sys.stdout.write('{:<28} {:>10} {:>10}\n'.format('case', 'min ms', 'median ms'))
+		for name, argv in cases:
+			times = time_command(argv, args.runs)
+			sys.stdout.write('{:<28} {:>10.1f} {:>10.1f}\n'.format(name, times[0] * 1000, times[len(times) // 2] * 1000))
+	finally:
+		simulator.kill()
+		simulator.wait()
+		shutil.rmtree(directory)
+	package = subprocess.check_output([sys.executable, '-c', CHECK_PACKAGE], cwd=HERE)
+	if package:
+		sys.stdout.write('import powerpod loads: {}\n'.format(package))
+	eager = subprocess.check_output([sys.executable, '-c', CHECK_IMPORTS.format(command, LAZY_MODULES)], cwd=HERE)
+	if eager:
+		sys.stdout.write('imported at startup: {}\n'.format(eager))
+	if package or eager:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
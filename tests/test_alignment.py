@@ -0,0 +1,106 @@
+import unittest
+
+import numpy
+
+from powerpod import alignment
+
+def pearson(pairs):
+	n = float(len(pairs))
+	mean_x = sum(x for x, _y in pairs) / n
+	mean_y = sum(y for _x, y in pairs) / n
+	covariance = sum((x - mean_x) * (y - mean_y) for x, y in pairs) / n
+	var_x = sum((x - mean_x) ** 2 for x, _y in pairs) / n
+	var_y = sum((y - mean_y) ** 2 for _x, y in pairs) / n
+	if var_x == 0 or var_y == 0:
+		return 0.0
+	return covariance / (var_x * var_y) ** 0.5
+
+def brute_force_coefficient(newton, strava, lag, min_overlap):
+	pairs = []
+	for k in range(len(strava)):
+		if 0 <= lag + k < len(newton) and newton[lag + k] is not None and strava[k] is not None:
+			pairs.append((newton[lag + k], strava[k]))
+	if len(pairs) < max(min_overlap, 1):
+		return 0.0
+	return pearson(pairs)
+
+def with_gaps(rng, values, rate):
+	return [None if rng.random_sample() < rate else float(value) for value in values]
+
+def ride(rng, length):
+	""" Something like a speed trace: a smoothed random walk. """
+	return numpy.convolve(numpy.cumsum(rng.normal(0, 1, length + 20)), numpy.ones(20) / 20, mode='valid')[:length]
+
+class BestLagTest(unittest.TestCase):
+	def test_matches_brute_force(self):
+		rng = numpy.random.RandomState(1)
+		for trial in range(5):
+			newton_length = rng.randint(20, 60)
+			strava_length = rng.randint(20, 60)
+			streams = [(with_gaps(rng, rng.normal(0, 1, newton_length), 0.2), with_gaps(rng, rng.normal(0, 1, strava_length), 0.2)) for _ in range(2)]
+			lags = range(-(strava_length - 5), newton_length - 5)
+			found, coefficients = alignment.best_lag(streams, lags, min_overlap=5)
+			totals = [sum(brute_force_coefficient(newton, strava, lag, 5) for newton, strava in streams) for lag in lags]
+			best = max(totals)
+			self.assertEqual(found, lags[totals.index(best)])
+			for (newton, strava), coefficient in zip(streams, coefficients):
+				self.assertAlmostEqual(coefficient, brute_force_coefficient(newton, strava, found, 5))
+
+	def test_every_lag_matches_brute_force(self):
+		rng = numpy.random.RandomState(2)
+		newton = with_gaps(rng, rng.normal(0, 1, 40), 0.1)
+		strava = with_gaps(rng, rng.normal(0, 1, 30), 0.1)
+		lags, coefficients = alignment.masked_correlation(*(alignment.to_masked(newton) + alignment.to_masked(strava)), min_overlap=3)
+		for lag, coefficient in zip(lags, coefficients):
+			self.assertAlmostEqual(coefficient, brute_force_coefficient(newton, strava, lag, 3), places=6)
+
+class CoarseToFineLagTest(unittest.TestCase):
+	def check_recovers(self, lag, newton_length, strava_length, seed):
+		rng = numpy.random.RandomState(seed)
+		# One track, seen by both from their own start; newton[lag + k] is strava[k].
+		start = max(lag, 0)
+		track = ride(rng, max(start + strava_length, start - lag + newton_length))
+		strava = track[start:start + strava_length]
+		newton = track[start - lag:start - lag + newton_length]
+		streams = [(with_gaps(rng, newton + rng.normal(0, 0.05, len(newton)), 0.05), with_gaps(rng, strava, 0.05))]
+		found, coefficients = alignment.coarse_to_fine_lag(streams)
+		self.assertEqual(found, lag)
+		self.assertGreater(coefficients[0], 0.9)
+
+	def test_positive_lag(self):
+		self.check_recovers(437, 4000, 3500, 3)
+
+	def test_negative_lag(self):
+		self.check_recovers(-1234, 3000, 5000, 4)
+
+class WarpTest(unittest.TestCase):
+	def test_isotonic_is_non_decreasing(self):
+		rng = numpy.random.RandomState(5)
+		values = list(rng.normal(0, 1, 200).cumsum() + rng.normal(0, 5, 200))
+		fitted = alignment._isotonic(values, [1.0] * len(values))
+		self.assertEqual(len(fitted), len(values))
+		self.assertTrue(all(a <= b for a, b in zip(fitted, fitted[1:])))
+		# Least squares keeps the mean.
+		self.assertAlmostEqual(sum(fitted), sum(values))
+
+	def test_isotonic_pools_violators(self):
+		self.assertEqual(alignment._isotonic([1.0, 3.0, 2.0, 4.0], [1.0] * 4), [1.0, 2.5, 2.5, 4.0])
+
+	def test_warp_never_goes_backwards(self):
+		# The knots' lags jump about by more than the time between them, which would make a plain interpolation go backwards.
+		knots = [((0, 1000), [(100, 10), (200, 150), (300, 20), (400, 200), (500, 30)]), ((1000, 2000), [(1500, -50)])]
+		warp = alignment.fit_warp(knots, 0, 2000)
+		self.assertFalse(numpy.isnan(warp).any())
+		self.assertTrue((numpy.diff(warp) >= -1e-9).all())
+
+	def test_resample_gives_seconds_and_a_mask(self):
+		warp = numpy.array([numpy.nan, 10.0, 11.0, 12.0, numpy.nan, 20.0])
+		seconds, present = alignment.resample(warp, [9.0, 10.2, 11.6, 15.0, 20.4, 30.0])
+		self.assertEqual(seconds.dtype, numpy.int64)
+		self.assertEqual(present.tolist(), [False, True, True, False, True, False])
+		self.assertEqual(seconds[present].tolist(), [1, 3, 5])
+
+	def test_resample_without_any_warp(self):
+		seconds, present = alignment.resample(numpy.array([numpy.nan] * 3), [1.0, 2.0])
+		self.assertEqual(len(seconds), 2)
+		self.assertFalse(present.any())
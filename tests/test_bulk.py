@@ -0,0 +1,20 @@
+import os.path
+import unittest
+
+from powerpod import bulk
+
+class OutputFilenameTest(unittest.TestCase):
+	def test_beside_the_ride(self):
+		self.assertEqual(bulk.output_filename(os.path.join('rides', '2016', 'a.raw'), 'decode', 'rides'), os.path.join('rides', '2016', 'a.decode.json'))
+
+	def test_subdirectories_are_kept(self):
+		outputs = [bulk.output_filename(os.path.join('rides', year, 'a.raw'), 'tcx', 'rides', 'out') for year in ('2016', '2017')]
+		self.assertEqual(outputs, [os.path.join('out', '2016', 'a.tcx'), os.path.join('out', '2017', 'a.tcx')])
+
+	def test_manifest_keys_differ(self):
+		processor = bulk.BulkProcessor('tcx', output_directory='out')
+		keys = set(processor.manifest_key('rides', os.path.join('out', year, 'a.tcx')) for year in ('2016', '2017'))
+		self.assertEqual(len(keys), 2)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,64 @@
+import datetime
+import unittest
+
+import numpy
+
+from powerpod import columns, synthetic, types
+
+def random_record(rng):
+	""" 15 random bytes which aren't a pause record, decoded; every field takes values across its whole range, signs included. """
+	while True:
+		data = rng.randint(0, 256, types.RECORD_SIZE).astype(numpy.uint8).tostring()
+		if not data.startswith(types.PAUSE_TAG):
+			return types.NewtonRideData.from_binary(data)
+
+def pause(start, seconds):
+	return types.NewtonRideDataPaused.from_binary(synthetic.encode_pause(start + datetime.timedelta(seconds=seconds)))
+
+class RideColumnsTest(unittest.TestCase):
+	def assert_matches_records(self, data):
+		ride = types.NewtonRide.from_binary(data)
+		ride_columns = columns.RideColumns.from_binary(data)
+		timed = list(ride.timed_records())
+		self.assertEqual(len(ride_columns), len(timed))
+		start = ride.start_time.as_datetime()
+		for i, (time, record) in enumerate(timed):
+			self.assertEqual(ride_columns.time[i], (time - start).total_seconds(), i)
+			for name, _size, _decode, _encode in types.RIDE_DATA_FIELDS:
+				self.assertAlmostEqual(getattr(ride_columns, name)[i], getattr(record, name), places=9, msg=(i, name))
+
+	def test_synthetic_ride_with_pauses(self):
+		ride = synthetic.SyntheticRides(seed=3, seconds=1000, pause_every=240, pause_seconds=45).ride(0)
+		data = str(ride.to_binary())
+		self.assertTrue(ride.pauses)
+		self.assert_matches_records(data)
+
+	def test_random_records(self):
+		rng = numpy.random.RandomState(0)
+		start = types.NewtonRide.make([]).start_time.as_datetime()
+		records = [random_record(rng) for _ in range(200)]
+		records[50:50] = [pause(start, 1000)]
+		records[120:120] = [pause(start, 2000), pause(start, 2500)]
+		data = types.NewtonRide.make(records).to_binary()
+		self.assert_matches_records(data)
+
+	def test_ride_starting_with_a_pause(self):
+		rng = numpy.random.RandomState(1)
+		start = types.NewtonRide.make([]).start_time.as_datetime()
+		records = [pause(start, 30)] + [random_record(rng) for _ in range(20)] + [pause(start, 100)]
+		self.assert_matches_records(types.NewtonRide.make(records).to_binary())
+
+	def test_air_speed_matches_the_ride_calibration(self):
+		data = str(synthetic.SyntheticRides(seed=4, seconds=600).ride(0).to_binary())
+		ride = types.NewtonRide.from_binary(data)
+		air_speed = columns.RideColumns.from_binary(data).air_speed_kph()
+		for i, record in enumerate(ride.records):
+			self.assertAlmostEqual(air_speed[i], ride.wind_speed_kph(record), places=9)
+
+	def test_no_records(self):
+		ride_columns = columns.RideColumns.from_binary(types.NewtonRide.make([]).to_binary())
+		self.assertEqual(len(ride_columns), 0)
+		self.assertEqual(list(ride_columns.segments()), [])
+
+if __name__ == '__main__':
+	unittest.main()
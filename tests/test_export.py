@@ -0,0 +1,38 @@
+import StringIO
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+from powerpod import export, synthetic, types
+
+NAMESPACES = {'tcx': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2', 'powerpod': 'https://github.com/bucko909/powerpod'}
+
+def export_tcx(ride):
+	fd = StringIO.StringIO()
+	export.export_tcx(ride, fd)
+	return ElementTree.fromstring(fd.getvalue())
+
+class TCXTest(unittest.TestCase):
+	def test_a_lap_between_each_pause(self):
+		source = synthetic.SyntheticRides(seed=2, seconds=1000, pause_every=300).ride(0)
+		ride = types.NewtonRide.from_binary(str(source.to_binary()))
+		laps = export_tcx(ride).findall('.//tcx:Lap', NAMESPACES)
+		self.assertEqual(len(laps), source.pauses + 1)
+		seconds = [int(lap.find('tcx:TotalTimeSeconds', NAMESPACES).text) for lap in laps]
+		self.assertEqual(seconds, [300, 300, 300, 100])
+		self.assertEqual(seconds, [len(lap.findall('.//tcx:Trackpoint', NAMESPACES)) for lap in laps])
+		# Each lap's distance is what its last point adds to the one before.
+		distances = [float(lap.find('tcx:DistanceMeters', NAMESPACES).text) for lap in laps]
+		last_point = float(laps[-1].findall('.//tcx:Trackpoint', NAMESPACES)[-1].find('tcx:DistanceMeters', NAMESPACES).text)
+		self.assertAlmostEqual(sum(distances), last_point, delta=0.2)
+		point = laps[0].find('.//tcx:Trackpoint', NAMESPACES)
+		record = ride.records[0]
+		self.assertAlmostEqual(float(point.find('.//powerpod:temperature', NAMESPACES).text), record.temperature_kelvin - 273.15, places=1)
+		self.assertAlmostEqual(float(point.find('.//powerpod:air_speed', NAMESPACES).text), ride.wind_speed_kph(record), places=2)
+
+	def test_empty_ride(self):
+		laps = export_tcx(types.NewtonRide.make([])).findall('.//tcx:Lap', NAMESPACES)
+		self.assertEqual(len(laps), 1)
+		self.assertEqual(laps[0].find('tcx:TotalTimeSeconds', NAMESPACES).text, '0')
+
+if __name__ == '__main__':
+	unittest.main()
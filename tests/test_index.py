@@ -0,0 +1,19 @@
+import unittest
+
+from powerpod import index
+
+class ParseConditionTest(unittest.TestCase):
+	def test_conditions(self):
+		self.assertEqual(index.parse_condition('max_power_watts > 800'), ('"max_power_watts" > ?', [800.0]))
+		self.assertEqual(index.parse_condition('distance_metres>=12000'), ('"distance_metres" >= ?', [12000.0]))
+		self.assertEqual(index.parse_condition('filename LIKE %2016%'), ('"filename" LIKE ?', ['%2016%']))
+		self.assertEqual(index.parse_condition('filename = "1 2"'), ('"filename" = ?', ['1 2']))
+		self.assertEqual(index.parse_condition('max_power_watts is  not null'), ('"max_power_watts" IS NOT NULL', []))
+
+	def test_only_values_as_parameters(self):
+		self.assertEqual(index.parse_condition("filename = x' OR 1=1 --"), ('"filename" = ?', ["x' OR 1=1 --"]))
+		for text in ('1=1; DROP TABLE rides', 'nope > 1', 'max_power_watts; DROP TABLE rides', 'max_power_watts is 5', 'max_power_watts'):
+			self.assertRaises(ValueError, index.parse_condition, text)
+
+if __name__ == '__main__':
+	unittest.main()
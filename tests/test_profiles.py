@@ -0,0 +1,54 @@
+import unittest
+
+from powerpod import messages, profiles, types
+
+def snapshot():
+	return [types.NewtonProfile.default() for _ in range(4)], [types.NewtonProfileScreens.default() for _ in range(4)]
+
+class PlanProfileCommandsTest(unittest.TestCase):
+	def test_nothing_to_do(self):
+		current, screens = snapshot()
+		self.assertEqual(profiles.plan_profile_commands(0), [])
+		self.assertEqual(profiles.plan_profile_commands(0, current, screens, {0: {}, 1: {}}, {2: screens[2]}), [])
+
+	def test_setting_a_field_to_its_value_writes_nothing(self):
+		current, _screens = snapshot()
+		self.assertEqual(profiles.plan_profile_commands(0, current, desired_profiles={1: {'total_mass_lb': current[1].total_mass_lb}}), [])
+
+	def test_float_noise_writes_nothing(self):
+		current, _screens = snapshot()
+		# tilt_cal goes over the wire in tenths.
+		self.assertEqual(profiles.plan_profile_commands(0, current, desired_profiles={0: {'tilt_cal': current[0].tilt_cal + 1e-9}}), [])
+
+	def test_only_the_command_holding_the_field(self):
+		current, _screens = snapshot()
+		commands = profiles.plan_profile_commands(0, current, desired_profiles={0: {'total_mass_lb': 190}})
+		self.assertEqual([type(command) for command in commands], [messages.SetProfileDataCommand])
+		self.assertEqual(commands[0].total_mass_lb, 190)
+		self.assertEqual(commands[0].aero, messages.SetProfileDataCommand(*(getattr(current[0], field) for field in messages.SetProfileDataCommand._fields)).aero)
+		commands = profiles.plan_profile_commands(0, current, desired_profiles={0: {'power_smoothing_seconds': 5}})
+		self.assertEqual(commands, [messages.SetProfileData2Command(5, current[0].unknown_c)])
+
+	def test_other_profile_is_selected_and_then_deselected(self):
+		current, _screens = snapshot()
+		commands = profiles.plan_profile_commands(1, current, desired_profiles={3: {'total_mass_lb': 190}})
+		self.assertEqual([type(command) for command in commands], [messages.SetProfileNumberCommand, messages.SetProfileDataCommand, messages.SetProfileNumberCommand])
+		self.assertEqual((commands[0].number, commands[-1].number), (3, 1))
+
+	def test_each_profile_selected_once_current_first(self):
+		current, screens = snapshot()
+		wanted_screens = types.NewtonProfileScreens.default()
+		wanted_screens.set_screen(wanted_screens.RIGHT, wanted_screens.TOP, wanted_screens.METRIC_OTHER, wanted_screens.AGG_NOW)
+		self.assertNotEqual(wanted_screens.to_binary(), screens[2].to_binary())
+		commands = profiles.plan_profile_commands(
+			2, current, screens,
+			desired_profiles={0: {'total_mass_lb': 190}, 2: {'power_smoothing_seconds': 3}},
+			desired_screens={0: screens[0], 2: wanted_screens},
+		)
+		self.assertEqual([type(command) for command in commands], [
+			messages.SetProfileData2Command, messages.SetScreensCommand,
+			messages.SetProfileNumberCommand, messages.SetProfileDataCommand,
+			messages.SetProfileNumberCommand,
+		])
+		self.assertEqual(commands[1].screens, wanted_screens)
+		self.assertEqual([command.number for command in commands if isinstance(command, messages.SetProfileNumberCommand)], [0, 2])
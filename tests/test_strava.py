@@ -0,0 +1,100 @@
+import mimetools
+import os.path
+import shutil
+import StringIO
+import tempfile
+import time
+import unittest
+import urllib2
+
+import simplejson
+
+from powerpod import strava
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ACTIVITY_ID = 12345
+
+def load_fixture():
+	with open(os.path.join(FIXTURES, '{}.json'.format(ACTIVITY_ID)), 'r') as fd:
+		return simplejson.load(fd)
+
+class StubOpener(object):
+	""" Answers each request with the next of replies: an exception to raise, or (body, headers) to return. """
+	def __init__(self, *replies):
+		self.replies = list(replies)
+		self.requests = []
+
+	def open(self, request):
+		self.requests.append(request)
+		reply = self.replies.pop(0)
+		if isinstance(reply, Exception):
+			raise reply
+		body, headers = reply
+		message = mimetools.Message(StringIO.StringIO(''.join('{}: {}\r\n'.format(name, value) for name, value in headers.items()) + '\r\n'))
+		return urllib2.addinfourl(StringIO.StringIO(body), message, request.get_full_url(), 200)
+
+class FileStreamProviderTest(unittest.TestCase):
+	def test_saved_streams(self):
+		streams = strava.FileStreamProvider(FIXTURES).get_streams(ACTIVITY_ID, ('time', 'heartrate'))
+		self.assertEqual([stream['type'] for stream in streams], ['time', 'heartrate'])
+		self.assertEqual(streams[0]['data'], [0, 1, 2, 3, 4, 5])
+
+	def test_missing(self):
+		self.assertRaises(IOError, strava.FileStreamProvider(FIXTURES).get_streams, 1)
+
+class CachingStreamProviderTest(unittest.TestCase):
+	def setUp(self):
+		self.cache_directory = tempfile.mkdtemp()
+		self.streams = load_fixture()
+		self.filename = strava.cache_filename(self.cache_directory, ACTIVITY_ID, strava.DEFAULT_TYPES)
+
+	def tearDown(self):
+		shutil.rmtree(self.cache_directory)
+
+	def cache(self, fetched, etag='"v1"', last_modified='Fri, 01 Jan 2016 08:00:00 GMT'):
+		with open(self.filename, 'w') as fd:
+			simplejson.dump({'fetched': fetched, 'etag': etag, 'last_modified': last_modified, 'streams': self.streams}, fd)
+
+	def cached(self):
+		with open(self.filename, 'r') as fd:
+			return simplejson.load(fd)
+
+	def provider(self, opener, max_age=0):
+		return strava.CachingStreamProvider(token='token', cache_directory=self.cache_directory, max_age=max_age, opener=opener)
+
+	def test_fetch_and_cache(self):
+		opener = StubOpener((simplejson.dumps(self.streams), {'ETag': '"v2"', 'Last-Modified': 'Sat, 02 Jan 2016 08:00:00 GMT'}))
+		self.assertEqual(self.provider(opener).get_streams(ACTIVITY_ID), self.streams)
+		self.assertIsNone(opener.requests[0].get_header('If-none-match'))
+		self.assertEqual(self.cached()['etag'], '"v2"')
+		self.assertEqual(self.cached()['last_modified'], 'Sat, 02 Jan 2016 08:00:00 GMT')
+		# The saved copy can be read offline, too.
+		self.assertEqual(strava.FileStreamProvider(self.cache_directory).get_streams(ACTIVITY_ID, ('cadence',)), strava.only_types(self.streams, ('cadence',)))
+
+	def test_cache_hit(self):
+		self.cache(time.time())
+		opener = StubOpener()
+		self.assertEqual(self.provider(opener, max_age=3600).get_streams(ACTIVITY_ID), self.streams)
+		self.assertEqual(opener.requests, [])
+
+	def test_not_modified(self):
+		self.cache(time.time() - 7200)
+		opener = StubOpener(urllib2.HTTPError('url', 304, 'Not Modified', None, None))
+		self.assertEqual(self.provider(opener, max_age=3600).get_streams(ACTIVITY_ID), self.streams)
+		request, = opener.requests
+		self.assertEqual(request.get_header('If-none-match'), '"v1"')
+		self.assertEqual(request.get_header('If-modified-since'), 'Fri, 01 Jan 2016 08:00:00 GMT')
+		# Good for another max_age.
+		self.assertGreater(self.cached()['fetched'], time.time() - 60)
+
+	def test_offline_uses_the_cache(self):
+		self.cache(time.time() - 7200)
+		opener = StubOpener(urllib2.URLError('no network'))
+		self.assertEqual(self.provider(opener).get_streams(ACTIVITY_ID), self.streams)
+
+	def test_offline_without_a_cache(self):
+		opener = StubOpener(urllib2.URLError('no network'))
+		self.assertRaises(urllib2.URLError, self.provider(opener).get_streams, ACTIVITY_ID)
+
+if __name__ == '__main__':
+	unittest.main()
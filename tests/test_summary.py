@@ -0,0 +1,20 @@
+import unittest
+
+from powerpod import columns, summary, types
+
+def summarise(records):
+	return summary.summarise(columns.RideColumns.from_binary(types.NewtonRide.make(records).to_binary()))
+
+class SummaryTest(unittest.TestCase):
+	def test_no_data_is_none(self):
+		metrics = summarise([])
+		self.assertIsNone(metrics['average_power_watts'])
+		self.assertIsNone(metrics['max_power_watts'])
+
+	def test_zero_watts_is_zero(self):
+		metrics = summarise([types.NewtonRideData(10, 0, 100, 100, 0, 0.0, 10.0, 620, 0, 0, 0, 0, 5) for _ in range(60)])
+		self.assertEqual(metrics['average_power_watts'], 0)
+		self.assertEqual(metrics['max_power_watts'], 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from powerpod import messages, synthetic, types
+
+class SyntheticRideTest(unittest.TestCase):
+	def setUp(self):
+		self.source = synthetic.SyntheticRides(seed=1, seconds=(1000, 4000), pause_every=600, pause_seconds=30)
+
+	def test_stream_slices_match_the_whole_ride(self):
+		stream = self.source.ride(2).to_binary()
+		data = str(stream)
+		self.assertEqual(len(stream), len(data))
+		self.assertEqual(''.join(stream[i:i + 63] for i in range(0, len(stream) + 1, 63)), data)
+		# Going back starts again.
+		self.assertEqual(stream[100:200], data[100:200])
+
+	def test_sample_rate(self):
+		every_second = self.source.ride(2)
+		every_5_seconds = self.source.ride(2, sample_seconds=5)
+		ride = types.NewtonRide.from_binary(str(every_5_seconds.to_binary()))
+		self.assertEqual(ride.unknown_2, 5)
+		self.assertEqual(ride.size, len(ride.records))
+		data_records = [record for record in ride.records if isinstance(record, types.NewtonRideData)]
+		self.assertEqual(len(data_records), -(-every_second.seconds // 5))
+		# The same riding, so about the same energy and distance.
+		self.assertAlmostEqual(ride.energy_kJ, every_second.header.energy_kJ, delta=every_second.header.energy_kJ * 0.05)
+		self.assertAlmostEqual(every_5_seconds.get_header().distance_metres, every_second.get_header().distance_metres, delta=every_second.get_header().distance_metres * 0.05)
+		pauses = [record.newton_time.as_datetime() for record in ride.records if isinstance(record, types.NewtonRideDataPaused)]
+		self.assertEqual(len(pauses), every_5_seconds.pauses)
+		self.assertEqual((pauses[0] - every_5_seconds.start_time).total_seconds(), 600 + 30)
+
+	def test_set_sample_rate_command(self):
+		class Device(object):
+			sample_seconds = 1
+			def set_sample_seconds(self, sample_seconds):
+				self.sample_seconds = sample_seconds
+		device = Device()
+		command = messages.SetSampleRateCommand(0, messages.SetSampleRateCommand.SAMPLE_RATE_5_SECONDS)
+		self.assertIsNone(command.get_response(device))
+		self.assertEqual(device.sample_seconds, 5)
+
+if __name__ == '__main__':
+	unittest.main()